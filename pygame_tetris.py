@@ -3,11 +3,24 @@
 
 import pygame
 from pygame.locals import *
-from copy import deepcopy
 from os.path import join, dirname, expanduser
-import pickle
+from array import array
+from collections import OrderedDict
+import json
 import random
 import sys
+import time
+
+try:
+    import numpy
+except ImportError:  # звезды считаются списками без NumPy
+    numpy = None
+
+import tetris_bot
+import tetris_replay
+import tetris_save
+from tetris_engine import (TetrisEngine, TICK_MS, INPUT_LEFT, INPUT_RIGHT, INPUT_DOWN, INPUT_ROTATE,
+                           INPUT_DROP, EVENT_MOVE, EVENT_ROTATE, EVENT_PLACE, EVENT_LINE, EVENT_LEVEL, EVENT_GAME_OVER)
 
 
 # const
@@ -15,7 +28,34 @@ BLACK = pygame.Color('#333333')
 GREY = pygame.Color('#808080')
 WHITE = pygame.Color('#fafafa')
 LIGHT = pygame.Color('#bdbdbd')
-FPS = 60
+FPS = 60  # кадров в секунду, от нее не зависит скорость игры
+IDLE_FPS = 10  # кадров в секунду в меню, в info и после конца игры; 0 - фон замирает, кадр только по событию
+DAS_MS = 167  # задержка перед повтором зажатой клавиши
+ARR_MS = 167  # интервал повтора зажатой клавиши
+TOUCH_BLOCK_MS = 117  # пауза между жестами
+MAX_FRAME_MS = 250  # больше за кадр не догоняем
+COMPACT_LOCKS = 100  # фиксаций в журнале до нового снимка
+STARS = 120  # количество звезд на фоне
+STAR_SPEED = 0.015  # пикселей в миллисекунду на пиксель размера звезды
+DIRTY_RECTS = True  # выводить на экран только изменившиеся области кадра
+FRAME_HISTORY = 600  # кадров в кольцевых буферах замеров
+HUD_REFRESH_MS = 500  # период обновления цифр и графика на экране производительности
+HUD_BARS = 120  # кадров на графике времени кадра
+
+# клавиши действий по умолчанию; rotate - поворот, а в меню выбор пункта
+KEYS = {'left': (pygame.K_LEFT,), 'right': (pygame.K_RIGHT,), 'down': (pygame.K_DOWN,), 'up': (pygame.K_UP,),
+        'rotate': (), 'drop': (pygame.K_SPACE,), 'music': (pygame.K_m,), 'sound': (pygame.K_s,),
+        'menu': (pygame.K_ESCAPE, pygame.K_AC_BACK),  # android back_button
+        'info': (pygame.K_i,), 'hud': (pygame.K_p,), 'bot': (pygame.K_b,), 'resume': (pygame.K_r,), 'exit': (pygame.K_e,),
+        'new_game': (pygame.K_n,), 'select': (pygame.K_RETURN,)}
+# зажатые действия и флаги, которые снимает отпускание
+HELD = {'left': 'left', 'right': 'right', 'down': 'down', 'up': 'up', 'rotate': 'up'}
+# крестовина джойстика
+JOY_HAT = {(-1, 0): 'left', (1, 0): 'right', (0, -1): 'down', (0, 1): 'up'}
+# кнопки джойстика по умолчанию: A - поворот/выбор в меню, B - сброс, X - меню, Y - info
+JOY_BUTTONS = {0: 'rotate', 1: 'drop', 2: 'menu', 3: 'info'}
+# раскладки отдельных устройств по имени джойстика, например {'Some Pad': {1: 'rotate', 0: 'drop', 3: 'menu', 2: 'info'}}
+JOY_LAYOUTS = {}
 
 
 # Returns path containing content - either locally or in pyinstaller tmp file
@@ -26,6 +66,202 @@ def resourcePath():
     return join(dirname(__file__))
 
 
+class TextCache:
+    """Bounded LRU cache of rendered text surfaces keyed by (font, text, colour)"""
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color):
+        key = (font, text, tuple(color))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, True, color).convert_alpha()
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.maxsize:
+            self.surfaces.popitem(last=False)
+        return surface
+
+
+class StarField:
+    """Falling background stars kept in NumPy arrays and drawn with pre-rendered sprites"""
+
+    def __init__(self, surface, count=STARS, use_numpy=True):
+        self.surface = surface
+        self.width, self.height = surface.get_size()
+        self.use_numpy = use_numpy and numpy is not None
+        self.rects = []  # прямоугольники звезд в последнем кадре
+
+        # спрайт на каждый размер звезды 4..12
+        self.sprites = [None] * 13
+        for size in range(4, 13):
+            self.sprites[size] = pygame.Surface((size, size)).convert()
+            self.sprites[size].fill(LIGHT)
+
+        if self.use_numpy:
+            self.rng = numpy.random.default_rng()
+            self.size = self.rng.integers(4, 13, count)
+            self.speed = self.size * STAR_SPEED
+            self.x = self.rng.integers(0, self.width - self.size + 1)
+            self.y = self.rng.integers(0, self.height - self.size + 1).astype(float)
+            self.star_sprites = [self.sprites[size] for size in self.size.tolist()]
+        else:
+            # Начальное состояние звездного неба
+            self.star_list = []
+            for i in range(count):
+                size = random.randint(4, 12)
+                x = random.randint(0, self.width - size)
+                y = random.randint(0, self.height - size)
+                self.star_list.append([x, y, size])
+
+    def update(self, dt):
+        """Move the stars down for dt milliseconds, respawning the fallen ones at the top"""
+        if not self.use_numpy:
+            for star in self.star_list:
+                star[1] += star[2] * STAR_SPEED * dt  # скорость
+
+                if star[1] > self.height + star[2]:
+                    star[2] = random.randint(4, 12)
+                    star[0] = random.randint(0, self.width - star[2])
+                    star[1] = -star[2]
+            return
+
+        self.y += self.speed * dt
+        fallen = numpy.flatnonzero(self.y > self.height + self.size)
+        if len(fallen):
+            size = self.rng.integers(4, 13, len(fallen))
+            self.size[fallen] = size
+            self.speed[fallen] = size * STAR_SPEED
+            self.x[fallen] = self.rng.integers(0, self.width - size + 1)
+            self.y[fallen] = -size
+            for i, s in zip(fallen.tolist(), size.tolist()):
+                self.star_sprites[i] = self.sprites[s]
+
+    def draw(self):
+        """Draw the stars, remember their rects for dirty-rect updates"""
+        if not self.use_numpy:
+            self.rects = [pygame.draw.rect(self.surface, LIGHT, (star[0], star[1], star[2], star[2]))
+                          for star in self.star_list]
+            return
+        self.rects = self.surface.blits(zip(self.star_sprites, zip(self.x.tolist(), self.y.tolist())))
+
+
+class Effect:
+    """Frame-sliced animation: advanced by update(dt) every frame, finished early by skip()"""
+
+    duration = 0  # мс
+
+    def __init__(self):
+        self.elapsed = 0
+
+    @property
+    def done(self):
+        return self.elapsed >= self.duration
+
+    def update(self, dt):
+        self.elapsed = min(self.elapsed + dt, self.duration)
+
+    def skip(self):
+        self.elapsed = self.duration
+
+    def draw(self, surface):
+        pass
+
+
+class GameOverEffect(Effect):
+    """Board cells fill one by one with random colours, 150 cells per second"""
+
+    def __init__(self, grid, random_color):
+        super().__init__()
+        self.grid = grid
+        self.colors = [random_color() for i_rect in grid]
+        self.duration = len(grid) * 1000 / 150
+
+    def draw(self, surface):
+        count = int(len(self.grid) * self.elapsed / self.duration)
+        for i in range(count):
+            pygame.draw.rect(surface, self.colors[i], self.grid[i])
+
+
+class FrameTimer:
+    """Ring buffers with the time of the last frames and of their phases, in milliseconds"""
+    PHASES = ('events', 'stars', 'grid', 'logic', 'field', 'text', 'flip')
+
+    def __init__(self, size=FRAME_HISTORY):
+        self.size = size
+        self.count = 0  # кадров замерено всего
+        self.index = 0  # ячейка текущего кадра
+        self.frames = array('d', bytes(8 * size))
+        self.phases = {phase: array('d', bytes(8 * size)) for phase in self.PHASES}
+        self.begin = self.last = 0
+
+    def start(self):
+        self.begin = self.last = time.perf_counter()
+
+    def mark(self, phase):
+        """Close the phase that ran since the previous mark"""
+        now = time.perf_counter()
+        self.phases[phase][self.index] = (now - self.last) * 1000
+        self.last = now
+        if phase == 'flip':
+            self.frames[self.index] = (now - self.begin) * 1000
+            self.count += 1
+            self.index = self.count % self.size
+
+    def values(self, phase=None):
+        """Recorded frame times, or the times of one phase, oldest first"""
+        buffer = self.phases[phase] if phase else self.frames
+        if self.count <= self.size:
+            return buffer[:self.count].tolist()
+        return buffer[self.index:].tolist() + buffer[:self.index].tolist()
+
+    def csv(self):
+        """Recorded frames as CSV bytes: frame time and the time of every phase"""
+        columns = [self.values()] + [self.values(phase) for phase in self.PHASES]
+        rows = [','.join(('frame',) + self.PHASES)]
+        rows += [','.join('%.3f' % value for value in row) for row in zip(*columns)]
+        return ('\n'.join(rows) + '\n').encode()
+
+
+def load_bindings(path):
+    """Return {key: action} and the joystick layouts, with the overrides of a JSON config applied
+
+    The config looks like {"keys": {"left": ["left", "a"]}, "joysticks": {"Some Pad": {"1": "rotate"}}},
+    key names are those of pygame.key.name().
+    """
+    keys, layouts = dict(KEYS), dict(JOY_LAYOUTS)
+    try:
+        with open(path) as f:
+            config = json.load(f)
+        for action, names in config.get('keys', {}).items():
+            if action not in KEYS:
+                raise ValueError('unknown action %r' % action)
+            keys[action] = tuple(pygame.key.key_code(name) for name in names)
+        for name, layout in config.get('joysticks', {}).items():
+            layouts[name] = {int(button): action for button, action in layout.items()}
+            if not set(layouts[name].values()) <= set(KEYS):
+                raise ValueError('unknown action in joystick layout %r' % name)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, AttributeError, TypeError) as e:
+        print('config not loaded: %s' % e, file=sys.stderr)
+        keys, layouts = dict(KEYS), dict(JOY_LAYOUTS)
+    return {key: action for action, codes in keys.items() for key in codes}, layouts
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of a sorted list"""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
 class Game:
     """Create a single-window app"""
 
@@ -50,36 +286,26 @@ class Game:
                      range(20)]
 
         # Фигуры
-        self.figures_pos = [[(-1, 0), (-2, 0), (0, 0), (1, 0)],
-                            [(0, -1), (-1, -1), (-1, 0), (0, 0)],
-                            [(-1, 0), (-1, 1), (0, 0), (0, -1)],
-                            [(0, 0), (-1, 0), (0, 1), (-1, -1)],
-                            [(0, 0), (0, -1), (0, 1), (-1, -1)],
-                            [(-1, 0), (-1, -1), (-1, 1), (0, -1)],
-                            [(0, 0), (0, -1), (0, 1), (-1, 0)]]
-
-        self.figures = [[pygame.Rect(x + 5, y + 1, 1, 1) for x, y in fig_pos] for fig_pos in self.figures_pos]
         self.figure_rect = pygame.Rect(0, 0, self.TILE - 2, self.TILE - 2)
-
-        self.figure, self.next_figure = deepcopy(random.choice(self.figures)), deepcopy(random.choice(self.figures))
         self.random_color = lambda: (random.randint(128, 255), random.randint(128, 255), random.randint(128, 255))
-        self.color, self.next_color = self.random_color(), self.random_color()
 
-        # Матрица игрового поля
-        self.field = [[0 for i in range(10)] for j in range(20)]
+        # Правила игры: поле, фигуры, счет
+        self.engine = TetrisEngine()
+        self.bot = None  # автоигра нажимает те же входы, что и игрок
 
+        # анимации поверх поля, не останавливающие игровой цикл
+        self.effects = []
+
+        # фиксированный шаг: время кадра копится и расходуется шагами TICK_MS
         self.clock = pygame.time.Clock()
-        self.count_frame = 0
+        self.frame_ms = 0
+        self.accumulator = 0
+        self.inputs = 0  # входы до ближайшего шага
+        self.repeat_ms = 0
         self.left, self.right, self.down, self.up = False, False, False, False
 
-        # Параметры анимации движения
-        self.anim_count, self.anim_speed, self.anim_limit = 0, 1, FPS
-
-        self.best = 0
-        self.score = 0
-        self.level = 1
-
         # текст
+        self.text_cache = TextCache()
         self.game_font = pygame.font.Font(join(resourcePath(), 'PressStart2P-Regular.ttf'), int(self.TILE / 1.5))
         self.next_text = self.game_font.render('next', True, WHITE)
         self.best_text = self.game_font.render('best', True, WHITE)
@@ -116,6 +342,8 @@ class Game:
         self.exit_button = self.exit_text.get_rect(x=self.pos[0], y=self.pos[1])
         self.exit_button.x += self.boardSurface.get_width() / 2 - self.exit_text.get_width() / 2
         self.exit_button.y += self.TILE * 12 + self.TILE * 0.15
+        self.menu_buttons = (self.resume_button, self.newgame_button, self.music_button, self.sound_button,
+                             self.exit_button)  # по порядку пунктов select
 
         # info
         self.pos_info = self.infoSurface.get_abs_offset()
@@ -139,6 +367,8 @@ class Game:
                           '<Space>/<Joy1> - drop',
                           '<Esc>/<Joy2> - menu',
                           '<i>/<Joy3> - info',
+                          '<p> - performance',
+                          '<b> - autoplay',
                           '<r> - resume',
                           '<n> - new game',
                           '<m> - music',
@@ -155,11 +385,10 @@ class Game:
                           '(c) A.V.Bezdolny, 2020',
                           '* ver. 1.0 *']
 
-        # анимация исчезновения линий
-        self.anim_lines = False
-        self.count_anim_lines = 0
+        # статичные слои: сетка поля, подписи и кнопки панели
+        self.layers_tile = 0
+        self.build_layers()
 
-        self.game_over = False
         self.pause = False
         self.info = False
 
@@ -178,114 +407,225 @@ class Game:
         self.sound_place = pygame.mixer.Sound(join(resourcePath(), 'place.ogg'))
         self.sound_game_over = pygame.mixer.Sound(join(resourcePath(), 'game_over.ogg'))
 
-        # Initialize the joystick
+        # управление: клавиши и раскладки джойстиков переназначаются в ~/pygame_tetris.json
+        self.config_path = join(expanduser('~'), 'pygame_tetris.json')
+        self.key_bindings, self.joy_layouts = load_bindings(self.config_path)
+        self.actions = {
+            'left': self.key_left, 'right': self.key_right, 'down': self.key_down, 'up': self.key_up,
+            'rotate': self.key_rotate, 'drop': self.drop, 'music': self.set_music, 'sound': self.set_sound,
+            'menu': self.get_pause, 'info': self.get_info, 'hud': self.get_hud, 'bot': self.get_bot,
+            'resume': self.key_resume, 'exit': self.exit, 'new_game': self.new_game, 'select': self.key_select,
+        }
+        self.handlers = {
+            pygame.QUIT: self.on_quit,
+            pygame.KEYDOWN: self.on_key_down,
+            pygame.KEYUP: self.on_key_up,
+            pygame.JOYHATMOTION: self.on_joy_hat,
+            pygame.JOYBUTTONDOWN: self.on_joy_button_down,
+            pygame.JOYBUTTONUP: self.on_joy_button_up,
+            JOYDEVICEADDED: self.on_joy_added,
+            JOYDEVICEREMOVED: self.on_joy_removed,
+            pygame.MOUSEBUTTONDOWN: self.on_mouse_down,
+            FINGERMOTION: self.on_finger_motion,
+            WINDOWFOCUSLOST: self.on_focus_lost,
+            WINDOWEXPOSED: self.on_window_shown,
+            WINDOWRESTORED: self.on_window_shown,
+            WINDOWFOCUSGAINED: self.on_window_shown,
+        }
+        # движения мыши, осей и пальцев без обработчика отбрасываются еще в SDL
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(list(self.handlers))
+
+        # Initialize the joystick: новые устройства приходят событиями JOYDEVICEADDED
         pygame.joystick.init()
+        self.joysticks = {}  # instance_id -> (Joystick, раскладка кнопок)
+        for device_index in range(pygame.joystick.get_count()):
+            self.add_joystick(device_index)
 
         # Touch
         self.block = False
-        self.block_count = 0
-
-        # Начальное состояние звездного неба
-        self.star_list = []
-        for i in range(120):
-            size = random.randint(4, 12)
-            x = random.randint(0, self.windowSurface.get_width() - size)
-            y = random.randint(0, self.windowSurface.get_height() - size)
-            self.star_list.append([x, y, size])
-
-        self.dx = 0
-        self.dy = 0
-        self.rotate = False
+        self.block_ms = 0
+
+        # Звездное небо
+        self.stars = StarField(self.windowSurface)
+
+        # вывод изменившихся областей кадра вместо полного flip
+        self.dirty_rects = DIRTY_RECTS
+        self.dirty = []
+        self.full_redraw = True
+        self.board_key = self.info_key = self.piece_key = None
+        self.piece_rect = pygame.Rect(0, 0, 0, 0)
+        self.ghost_y = 0  # строка, на которую упадет фигура
+        self.board_rect = self.boardSurface.get_rect(topleft=self.boardSurface.get_abs_offset())
+        self.info_rect = self.infoSurface.get_rect(topleft=self.infoSurface.get_abs_offset())
+        self.window_area = self.windowSurface.get_width() * self.windowSurface.get_height()
+        self.pixels_pushed = 0  # пикселей выведено на экран в последнем кадре
+        self.timer = None  # FrameTimer замеряет фазы кадра, если задан
+
+        # экран производительности, замеры - с первого включения до выхода
+        self.hud = False
+        self.hud_ms = 0
+        self.hud_surface = None
+        self.frames_path = join(expanduser('~'), 'pygame_tetris_frames.csv')
         
         # load data
+        self.save_path = join(expanduser('~'), 'pygame_tetris.dat')  # заменить путь на 'pygame_tetris.dat' для android
+        self.journal_path = join(expanduser('~'), 'pygame_tetris.jnl')
+        self.replay_path = join(expanduser('~'), 'pygame_tetris.rpl')
+        self.recorder = None  # запись ввода: с seed новой игры или с загруженного состояния
         try:
-            with open(join(expanduser('~'), 'pygame_tetris.dat'), 'rb') as f:  # заменить путь на 'pygame_tetris.dat' для android
-                data = pickle.load(f)
-                self.best = data['best']
-                self.score = data['score']
-                self.level = data['level']
-                self.game_over = data['game_over']
-                self.anim_speed = data['anim_speed']
-                self.sound = data['sound']
-                self.music = data['music']
-                if not self.music: pygame.mixer.music.pause()
-                self.color = data['color']
-                self.next_color = data['next_color']
-                self.figure = data['figure']
-                self.next_figure = data['next_figure']
-                self.field = data['field']
-                self.pause = True
-        except:  # FileNotFoundError and other
-            pass
+            self.sound, self.music = tetris_save.load(self.save_path, self.engine, self.journal_path)
+            if not self.music: pygame.mixer.music.pause()
+            self.pause = True
+            self.recorder = tetris_replay.Recorder(self.engine.seed,
+                                                   tetris_save.pack(self.engine, self.sound, self.music))
+        except FileNotFoundError:
+            self.recorder = tetris_replay.Recorder(self.engine.seed)
+        except (OSError, tetris_save.SaveError) as e:
+            print('save not loaded: %s' % e, file=sys.stderr)
+            self.engine.new_game()
+            self.recorder = tetris_replay.Recorder(self.engine.seed)
+
+        # сохранение в фоновом потоке: снимок, после него - журнал фиксаций фигур
+        self.saver = tetris_save.SaveWriter(self.save_path, self.journal_path)
+        self.save_data()
+
+    def build_layers(self):
+        """Pre-render the grid, info labels and buttons into cached surfaces for the current TILE"""
+        self.layers_tile = self.TILE
+
+        self.board_layer = pygame.Surface(self.boardSurface.get_size(), pygame.SRCALPHA).convert_alpha()
+        [pygame.draw.rect(self.board_layer, GREY, i_rect, 1) for i_rect in self.grid]
+
+        self.info_layer = pygame.Surface(self.infoSurface.get_size(), pygame.SRCALPHA).convert_alpha()
+        self.info_layer.blit(self.next_text, (self.info_layer.get_width() / 2 - self.next_text.get_width() / 2, 0))
+        self.info_layer.blit(self.best_text, (self.info_layer.get_width() / 2 - self.best_text.get_width() / 2, self.TILE * 6))
+        self.info_layer.blit(self.lines_text, (self.info_layer.get_width() / 2 - self.lines_text.get_width() / 2, self.TILE * 9))
+        self.info_layer.blit(self.level_text, (self.info_layer.get_width() / 2 - self.level_text.get_width() / 2, self.TILE * 12))
+
+        # menu button
+        pygame.draw.rect(self.info_layer, WHITE, (self.TILE / 2, self.TILE * 19, self.TILE, self.TILE / 5))
+        pygame.draw.rect(self.info_layer, WHITE, (self.TILE / 2, self.TILE * 19 + 2 * self.TILE / 5, self.TILE, self.TILE / 5))
+        pygame.draw.rect(self.info_layer, WHITE, (self.TILE / 2, self.TILE * 19 + 4 * self.TILE / 5, self.TILE, self.TILE / 5))
+        # info button
+        pygame.draw.rect(self.info_layer, WHITE, (3 * self.TILE - self.TILE / 5, self.TILE * 19, 2 * self.TILE / 5, self.TILE / 5))
+        pygame.draw.rect(self.info_layer, WHITE,
+                         (3 * self.TILE - 2 * self.TILE / 5, self.TILE * 19 + 2 * self.TILE / 5, 2 * self.TILE / 5, self.TILE / 5 / 2))
+        pygame.draw.rect(self.info_layer, WHITE,
+                         (3 * self.TILE - self.TILE / 5, self.TILE * 19 + 2 * self.TILE / 5, 2 * self.TILE / 5, 3 * self.TILE / 5))
+        pygame.draw.rect(self.info_layer, WHITE,
+                         (2 * self.TILE + self.TILE / 2, self.TILE * 19 + self.TILE - self.TILE / 5 / 2, self.TILE, self.TILE / 5 / 2))
+
+        # экран info целиком: фон и все строки текста (нижние строки выходят за фон)
+        info_renders = [self.text_cache.render(self.info_font, row, WHITE) for row in self.info_text]
+        height = max(self.TILE * 16, int(info_renders[-1].get_height() * (len(info_renders) + 1) * 1.5))
+        self.info_overlay = pygame.Surface((self.TILE * 10 - 2, height), pygame.SRCALPHA).convert_alpha()
+        self.info_overlay.fill(BLACK, (0, 0, self.TILE * 10 - 2, self.TILE * 16))
+        for i, info_render in enumerate(info_renders):
+            self.info_overlay.blit(info_render, (self.boardSurface.get_width() / 2 - info_render.get_width() / 2 - 1,
+                                                 info_render.get_height() * (i + 1) * 1.5))
+
+    def update_display(self):
+        """Push only the changed regions of the frame, or the whole frame when too much has changed"""
+        dirty = self.dirty
+
+        # поле: занятые клетки, анимация линий и меню меняются только вместе с этим ключом
+        board_key = (tuple(self.engine.rows), self.engine.anim_lines, self.engine.game_over,
+                     self.pause, self.info, self.select, len(self.effects))
+        if board_key != self.board_key:
+            self.board_key = board_key
+            dirty.append(self.board_rect)
+
+        # фигура и ее тень: старое и новое положение
+        cells = self.engine.piece.cells()
+        piece_key = (cells, self.ghost_y, self.engine.color)
+        if piece_key != self.piece_key:
+            self.piece_key = piece_key
+            dirty.append(self.piece_rect)
+            xs, ys = [x for x, y in cells], [y for x, y in cells]
+            bottom = max(ys) + self.ghost_y - self.engine.piece.y
+            self.piece_rect = pygame.Rect(self.board_rect.x + min(xs) * self.TILE, self.board_rect.y + min(ys) * self.TILE,
+                                          (max(xs) - min(xs) + 1) * self.TILE, (bottom - min(ys) + 1) * self.TILE)
+            dirty.append(self.piece_rect)
+
+        # панель: счет, уровень и следующая фигура
+        info_key = (self.engine.best, self.engine.score, self.engine.level,
+                    self.engine.next_piece.figure_id, self.engine.next_color)
+        if info_key != self.info_key:
+            self.info_key = info_key
+            dirty.append(self.info_rect)
+
+        pixels = sum(r.w * r.h for r in dirty)
+        if self.full_redraw or pixels > self.window_area / 2:
+            self.full_redraw = False
+            pygame.display.flip()
+            self.pixels_pushed = self.window_area
+        else:
+            pygame.display.update(dirty)
+            self.pixels_pushed = pixels
+        dirty.clear()
 
     def save_data(self):
-        with open(join(expanduser('~'), 'pygame_tetris.dat'), 'wb') as f:  # заменить путь на 'pygame_tetris.dat' для android
-            data = {
-                'best' : self.best,
-                'score' : self.score,
-                'level' : self.level,
-                'game_over' : self.game_over,
-                'anim_speed' : self.anim_speed,
-                'sound' : self.sound,
-                'music' : self.music,
-                'color' : self.color,
-                'next_color' : self.next_color,
-                'figure' : self.figure,
-                'next_figure' : self.next_figure,
-                'field' : self.field
-            }
-            pickle.dump(data, f)
-    
+        self.saver.save(tetris_save.pack(self.engine, self.sound, self.music))
+        self.journal_count = 0
+
+    def save_replay(self):
+        if self.recorder and self.recorder.tick:
+            self.saver.write(self.replay_path, self.recorder.pack(self.engine))
+
     def new_game(self):
         self.select = 2
-        self.figure, self.next_figure = deepcopy(random.choice(self.figures)), deepcopy(random.choice(self.figures))
-        self.color, self.next_color = self.random_color(), self.random_color()
-        self.field = [[0 for i in range(10)] for j in range(20)]
-        self.anim_count, self.anim_speed, self.anim_limit = 0, 1, FPS
-        self.anim_lines = False
-        self.count_anim_lines = 0
-        self.score = 0
-        self.level = 1
-        self.game_over = False
+        self.save_replay()
+        self.engine.new_game()
+        self.recorder = tetris_replay.Recorder(self.engine.seed)
+        self.effects = []
+        self.save_data()
         self.pause = False
         self.info = False
 
     def exit(self):
         self.save_data()
+        self.save_replay()
+        if self.timer: self.saver.write(self.frames_path, self.timer.csv())
+        self.saver.close()
         pygame.quit()
         sys.exit(0)
 
     def key_left(self):
-        self.dx = -1
+        self.inputs |= INPUT_LEFT
         self.left = True
-        self.count_frame = 0
+        self.repeat_ms = DAS_MS
 
     def key_right(self):
-        self.dx = 1
+        self.inputs |= INPUT_RIGHT
         self.right = True
-        self.count_frame = 0
+        self.repeat_ms = DAS_MS
 
     def key_up(self):
         if self.pause:
             self.select -= 1
             if self.select < 1: self.select = 5
         else:
-            self.rotate = True
+            self.inputs |= INPUT_ROTATE
             self.up = True
-            self.count_frame = 0
+            self.repeat_ms = DAS_MS
 
     def key_down(self):
         if self.pause:
             self.select += 1
             if self.select > 5: self.select = 1
         else:
-            self.dy = 1
+            self.inputs |= INPUT_DOWN
             self.down = True
-            self.count_frame = 0
+            self.repeat_ms = DAS_MS
             if self.sound: self.sound_move.play()
 
     def drop(self):
-        self.anim_limit = 3
+        self.inputs |= INPUT_DROP
+
+    def skip_effects(self):
+        for effect in self.effects:
+            effect.skip()
 
     def set_music(self):
         self.music = False if self.music else True
@@ -299,7 +639,6 @@ class Game:
         self.info = False
         self.pause = False if self.pause else True
         self.select = 1
-        self.anim_limit = FPS
         if self.sound: self.sound_pause.play()
         self.save_data()
         return True
@@ -307,9 +646,166 @@ class Game:
     def get_info(self):
         self.pause = False
         self.info = False if self.info else True
-        self.anim_limit = FPS
         if self.sound: self.sound_pause.play()
 
+    def get_bot(self):
+        self.bot = None if self.bot else tetris_bot.Bot(self.engine)
+
+    def get_hud(self):
+        self.hud = False if self.hud else True
+        if self.hud and not self.timer: self.timer = FrameTimer()
+        self.hud_ms = HUD_REFRESH_MS
+        self.full_redraw = True
+
+    def build_hud(self):
+        """Render FPS, frame time percentiles, the phase breakdown and a frame time graph"""
+        rows = ['fps %.1f' % self.clock.get_fps(),
+                'pixels %d (%d%%)' % (self.pixels_pushed, self.pixels_pushed * 100 // self.window_area)]
+        frames = self.timer.values()
+        if frames:
+            ordered = sorted(frames)
+            mean = sum(frames) / len(frames)
+            rows.append('frame p50 %.2f p95 %.2f p99 %.2f' % (percentile(ordered, 0.5), percentile(ordered, 0.95),
+                                                             percentile(ordered, 0.99)))
+            for phase in FrameTimer.PHASES:
+                times = self.timer.values(phase)
+                phase_mean = sum(times) / len(times)
+                rows.append('%-6s %5.2f ms %3d%%' % (phase, phase_mean, phase_mean / mean * 100 if mean else 0))
+        renders = [self.info_font.render(row, True, WHITE) for row in rows]
+
+        line = int(self.info_font.get_linesize() * 1.3)
+        graph = self.TILE * 2
+        width = max([HUD_BARS * 2] + [render.get_width() for render in renders]) + 8
+        surface = pygame.Surface((width, line * len(renders) + graph + 12), pygame.SRCALPHA).convert_alpha()
+        surface.fill((0, 0, 0, 192))
+        for i, render in enumerate(renders):
+            surface.blit(render, (4, 4 + i * line))
+
+        # график: полоса на кадр, линия посередине - бюджет кадра при FPS
+        bottom = surface.get_height() - 4
+        budget = 1000 / FPS
+        for i, ms in enumerate(frames[-HUD_BARS:]):
+            height = min(graph, max(1, int(ms / budget * graph / 2)))
+            pygame.draw.rect(surface, LIGHT if ms <= budget else WHITE, (4 + i * 2, bottom - height, 1, height))
+        pygame.draw.line(surface, GREY, (4, bottom - graph // 2), (4 + HUD_BARS * 2, bottom - graph // 2))
+        return surface
+
+    def draw_hud(self):
+        self.hud_ms += self.frame_ms
+        if self.hud_ms >= HUD_REFRESH_MS:
+            self.hud_ms = 0
+            # новый экран может быть уже старого: его место тоже выводится
+            if self.dirty_rects and self.hud_surface: self.dirty.append(self.hud_surface.get_rect())
+            self.hud_surface = self.build_hud()
+        self.windowSurface.blit(self.hud_surface, (0, 0))
+        if self.dirty_rects: self.dirty.append(self.hud_surface.get_rect())
+
+    def add_joystick(self, device_index):
+        joystick = pygame.joystick.Joystick(device_index)
+        self.joysticks[joystick.get_instance_id()] = (joystick, self.joy_layouts.get(joystick.get_name(), JOY_BUTTONS))
+
+    def joy_action(self, event):
+        """Action of a joystick button in the layout of the device that sent it"""
+        device = self.joysticks.get(event.instance_id)
+        return (device[1] if device else JOY_BUTTONS).get(event.button)
+
+    def key_rotate(self):
+        if self.pause:
+            self.activate_menu_item()
+        else:
+            self.key_up()
+
+    def key_resume(self):
+        if self.pause or self.info:
+            self.resume()
+
+    def key_select(self):
+        if self.pause:
+            self.activate_menu_item()
+
+    def release(self, action):
+        flag = HELD.get(action)
+        if flag: setattr(self, flag, False)
+
+    def on_quit(self, event):
+        self.exit()
+
+    def on_key_down(self, event):
+        action = self.key_bindings.get(event.key)
+        if action: self.actions[action]()
+
+    def on_key_up(self, event):
+        self.release(self.key_bindings.get(event.key))
+
+    def on_joy_hat(self, event):
+        if event.value == (0, 0):  # Нейтралка ;)
+            if self.left or self.right or self.down:
+                self.left, self.right, self.down = False, False, False
+            elif self.up:
+                self.up = False
+        else:
+            action = JOY_HAT.get(event.value)
+            if action: self.actions[action]()
+
+    def on_joy_button_down(self, event):
+        action = self.joy_action(event)
+        if action: self.actions[action]()
+
+    def on_joy_button_up(self, event):
+        self.release(self.joy_action(event))
+
+    def on_joy_added(self, event):
+        self.add_joystick(event.device_index)
+
+    def on_joy_removed(self, event):
+        if self.joysticks.pop(event.instance_id, None):
+            # отпустить зажатое этим устройством и остановить игру
+            self.left, self.right, self.down, self.up = False, False, False, False
+            if not self.pause: self.get_pause()
+
+    def on_mouse_down(self, event):
+        if self.pause:
+            for select, button in enumerate(self.menu_buttons, 1):
+                if button.collidepoint(event.pos):
+                    self.select = select
+                    self.activate_menu_item()
+                    return
+        # info board
+        if self.menu_button.collidepoint(event.pos):
+            self.get_pause()
+        elif self.info_button.collidepoint(event.pos):
+            self.get_info()
+
+    def on_finger_motion(self, event):
+        if event.finger_id != 0 or self.block:
+            return
+        touch_dx = event.dx * self.windowSurface.get_width()
+        touch_dy = event.dy * self.windowSurface.get_height()
+        if abs(touch_dx) > self.TILE / 10 or abs(touch_dy) > self.TILE / 10:
+            # horizontal
+            if abs(touch_dx) >= abs(touch_dy):
+                if touch_dx < 0:
+                    self.inputs |= INPUT_LEFT
+                elif touch_dx > 0:
+                    self.inputs |= INPUT_RIGHT
+            # vertical
+            else:
+                if touch_dy < 0:
+                    self.inputs |= INPUT_ROTATE  # up
+                elif touch_dy > 0:
+                    if abs(touch_dy) > self.TILE:
+                        self.drop()
+                    else:
+                        self.inputs |= INPUT_DOWN
+                        if self.sound: self.sound_move.play()
+            self.block = True
+
+    def on_focus_lost(self, event):
+        if not self.pause: self.get_pause()
+
+    def on_window_shown(self, event):
+        self.full_redraw = True
+
     def resume(self):
         self.pause = False
         self.info = False
@@ -326,452 +822,197 @@ class Game:
         elif self.select == 5:
             self.exit()
 
+    def tick(self):
+        """Advance the game by one fixed TICK_MS step: key repeat, rules and sounds"""
+        # зажатие клавиши управления
+        if self.left or self.right or self.down or self.up:
+            self.repeat_ms -= TICK_MS
+            if self.repeat_ms <= 0:
+                self.repeat_ms += ARR_MS
+                if self.left:
+                    self.inputs |= INPUT_LEFT
+                if self.right:
+                    self.inputs |= INPUT_RIGHT
+                if self.down:
+                    self.inputs |= INPUT_DOWN
+                    if self.sound: self.sound_move.play()
+                if self.up:
+                    self.inputs |= INPUT_ROTATE
+
+        # шаг правил игры
+        if self.bot: self.inputs |= self.bot.inputs()
+        if self.recorder: self.recorder.record(self.inputs)
+        events = self.engine.step(self.inputs)
+        self.inputs = 0
+
+        # автосохранение: каждая фиксация в журнал, время от времени - новый снимок
+        if events & EVENT_PLACE:
+            self.saver.append(tetris_save.pack_lock(self.engine))
+            self.journal_count += 1
+            if self.journal_count >= COMPACT_LOCKS: self.save_data()
+
+        if self.sound:
+            if events & EVENT_MOVE: self.sound_move.play()
+            if events & EVENT_ROTATE: self.sound_rotate.play()
+            if events & EVENT_PLACE: self.sound_place.play()
+            if events & EVENT_GAME_OVER: self.sound_game_over.play()
+            if events & EVENT_LINE: self.sound_line.play()
+            if events & EVENT_LEVEL: self.sound_level.play()
+
+        # anim game_over
+        if events & EVENT_GAME_OVER:
+            self.effects.append(GameOverEffect(self.grid, self.random_color))
+
+    def idle(self):
+        """Nothing but the background moves: the menu, the info screen or the end of the game"""
+        return self.pause or self.info or (self.engine.game_over and not self.effects)
+
     def run(self):
         """Run the main event loop"""
+        events = None
         while True:
-            self.dx = 0
-            self.dy = 0
-            self.rotate = False
-
-            # "горячее" подключение джойстика
-            try:
-                joystick = pygame.joystick.Joystick(0)
-                joystick.init()
-            except:
-                joystick = None
-
-            # События
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.exit()
-
-                # keyboard
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_LEFT:
-                        self.key_left()
-                    if event.key == pygame.K_RIGHT:
-                        self.key_right()
-                    if event.key == pygame.K_DOWN:
-                        self.key_down()
-                    if event.key == pygame.K_UP:
-                        self.key_up()
-                    if event.key == pygame.K_SPACE:
-                        self.drop()
-                    if event.key == pygame.K_m:
-                        self.set_music()
-                    if event.key == pygame.K_s:
-                        self.set_sound()
-                    if event.key == pygame.K_ESCAPE or event.key == pygame.K_AC_BACK:  # android back_button
-                        self.get_pause()
-                    if event.key == pygame.K_i:
-                        self.get_info()
-                    if event.key == pygame.K_r and (self.pause or self.info):
-                        self.resume()
-                    if event.key == pygame.K_e:
-                        self.exit()
-                    if event.key == pygame.K_n:
-                        self.new_game()
-                    if event.key == pygame.K_RETURN and self.pause:
-                        self.activate_menu_item()
-
-                if event.type == pygame.KEYUP:
-                    if event.key == pygame.K_LEFT:
-                        self.left = False
-                    if event.key == pygame.K_RIGHT:
-                        self.right = False
-                    if event.key == pygame.K_DOWN:
-                        self.down = False
-                    if event.key == pygame.K_UP:
-                        self.up = False
-
-                # joystick hat
-                if event.type == pygame.JOYHATMOTION:
-                    if event.value == (0, 0):  # Нейтралка ;)
-                        if self.left or self.right or self.down:
-                            self.left, self.right, self.down = False, False, False
-                        elif self.up:
-                            self.up = False
-                    elif event.value == (-1, 0):  # LEFT
-                        self.key_left()
-                    elif event.value == (1, 0):  # RIGHT
-                        self.key_right()
-                    elif event.value == (0, -1):  # DOWN
-                        self.key_down()
-                    elif event.value == (0, 1):  # UP
-                        self.key_up()
-
-                # joystick buttons
-                if event.type == pygame.JOYBUTTONDOWN:
-                    if event.button == 0:  # A
-                        # menu actions
-                        if self.pause:
-                            self.activate_menu_item()
-                        # rotate
-                        else:
-                            self.key_up()
-                    if event.button == 1:  # B
-                        # drop
-                        self.drop()
-                    if event.button == 2:  # X
-                        # menu
-                        self.get_pause()
-                    if event.button == 3:  # Y
-                        # info
-                        self.get_info()
-
-                if event.type == pygame.JOYBUTTONUP:
-                    if event.button == 0:  # A
-                        self.up = False
-
-                # mouse
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    mouse_pos = event.pos  # get mouse position
-                    if self.resume_button.collidepoint(mouse_pos) and self.pause:
-                        self.select = 1
-                        self.resume()
-                    elif self.newgame_button.collidepoint(mouse_pos) and self.pause:
-                        self.select = 2
-                        self.new_game()
-                    elif self.music_button.collidepoint(mouse_pos) and self.pause:
-                        self.select = 3
-                        self.set_music()
-                    elif self.sound_button.collidepoint(mouse_pos) and self.pause:
-                        self.select = 4
-                        self.set_sound()
-                    elif self.exit_button.collidepoint(mouse_pos) and self.pause:
-                        self.select = 5
-                        self.exit()
-                    # info board
-                    elif self.menu_button.collidepoint(mouse_pos):
-                        self.get_pause()
-                    elif self.info_button.collidepoint(mouse_pos):
-                        self.get_info()
-
-                # touch
-                if event.type == FINGERMOTION and event.finger_id == 0 and not self.block:
-                    touch_dx = event.dx * self.windowSurface.get_width()
-                    touch_dy = event.dy * self.windowSurface.get_height()
-                    if abs(touch_dx) > self.TILE / 10 or abs(touch_dy) > self.TILE / 10:
-                        # horizontal
-                        if abs(touch_dx) >= abs(touch_dy):
-                            if touch_dx < 0:
-                                self.dx = -1  # left
-                            elif touch_dx > 0:
-                                self.dx = 1  # right
-                        # vertical
-                        else:
-                            if touch_dy < 0:
-                                self.rotate = True  # up
-                            elif touch_dy > 0:
-                                if abs(touch_dy) > self.TILE:
-                                    self.drop()
-                                else:
-                                    self.dy = 1  # down
-                                    if self.sound: self.sound_move.play()
-                        self.block = True
-
-                # window
-                if event.type == WINDOWFOCUSLOST and not self.pause:
-                    self.get_pause()
-
-            # Графика
-            self.windowSurface.fill(BLACK)
-
-            # Нанесение на поверхность белых прямоугольников - снега ;)
-            for star in self.star_list:
-                star[1] += star[2] / 4  # скорость
-
-                if star[1] > self.windowSurface.get_height() + star[2]:
-                    star[2] = random.randint(4, 12)
-                    star[0] = random.randint(0, self.windowSurface.get_width() - star[2])
-                    star[1] = -star[2]
-
-                pygame.draw.rect(self.windowSurface, LIGHT, (star[0], star[1], star[2], star[2]))
-
-            # draw grid
-            [pygame.draw.rect(self.boardSurface, GREY, i_rect, 1) for i_rect in self.grid]
-
-            # зажатие клавиши управления
-            if self.left or self.right or self.down or self.up:
-                self.count_frame += 1
-                if self.count_frame > 9:
-                    self.count_frame = 0
-                    if self.left:
-                        self.dx = -1
-                    if self.right:
-                        self.dx = 1
-                    if self.down:
-                        self.dy = 1
-                        if self.sound: self.sound_move.play()
-                    if self.up:
-                        self.rotate = True
-
-            # touch
-            if self.block:
-                self.block_count += 1
-                if self.block_count > 6:
-                    self.block_count = 0
-                    self.block = False
-
-            # move x
-            if self.dx != 0 and not self.anim_lines and not self.game_over and not self.pause and not self.info:
-                if self.sound: self.sound_move.play()
-                figure_old = deepcopy(self.figure)
-                for i in range(4):
-                    self.figure[i].x += self.dx
-                    if self.figure[i].x < 0 or self.figure[i].x > 9 or self.field[self.figure[i].y][self.figure[i].x]:
-                        self.figure = deepcopy(figure_old)
-                        break
-
-            # rotate
-            if self.rotate and not self.anim_lines and not self.game_over and not self.pause and not self.info:
-                if self.sound: self.sound_rotate.play()
-                figure_old = deepcopy(self.figure)
-
-                # квадрат не вращать !!!
-                matrix = [[self.figure[j].x, self.figure[j].y] for j in range(4)]
-                max_x = max([m[0] for m in matrix])
-                min_x = min([m[0] for m in matrix])
-                max_y = max([m[1] for m in matrix])
-                min_y = min([m[1] for m in matrix])
-                rez = max_x - min_x, max_y - min_y
-
-                if not (rez[0] == 1 and rez[1] == 1):
-                    # вращение
-                    center = self.figure[0]
-                    for i in range(4):
-                        x = self.figure[i].y - center.y
-                        y = self.figure[i].x - center.x
-                        self.figure[i].x = center.x - x
-                        self.figure[i].y = center.y + y
-
-                    # проверка выхода за границы или пересечения
-                    coord = [[self.figure[j].x, self.figure[j].y, 0] for j in range(4)]
-
-                    min_x = min([m[0] for m in coord])
-                    if min_x < 0:
-                        for a in range(4):
-                            coord[a][0] += abs(min_x)
-
-                    max_x = max([m[0] for m in coord])
-                    if max_x > 9:
-                        for a in range(4):
-                            coord[a][0] -= abs(max_x - 9)
-
-                    max_y = max([m[1] for m in coord])
-                    if max_y > 19:
-                        for a in range(4):
-                            coord[a][1] -= abs(max_y - 19)
-
-                    for a in range(4):
-                        coord[a][2] = (1 if self.field[coord[a][1]][coord[a][0]] else 0) if (
-                                0 <= coord[a][1] <= 19 and 0 <= coord[a][0] <= 9) else 0
-
-                    if 1 not in (c[2] for c in coord):
-                        for i in range(4):
-                            self.figure[i].x = coord[i][0]
-                            self.figure[i].y = coord[i][1]
-                    else:
-                        # проверка по горизонтали
-                        max_x = max([X[0] for X in coord])
-                        min_x = min([X[0] for X in coord])
-                        max_zx = max([Z[0] for Z in coord if Z[2] == 1])
-                        max_zy = max([Z[1] for Z in coord if Z[2] == 1])
-
-                        if max_zx > min_x and not self.field[max_zy][max_zx - 1]:
-                            # двигаем влево
-                            for i in range(4):
-                                coord[i][0] -= abs(max_x - max_zx + 1)
-                        elif max_zx < max_x and not self.field[max_zy][max_zx + 1]:
-                            # двигаем вправо
-                            for i in range(4):
-                                coord[i][0] += abs(max_zx - min_x + 1)
-
-                        # проверка по вертикали
-                        max_y = max([Y[1] for Y in coord])
-                        min_y = min([Y[1] for Y in coord])
-                        max_zx = max([Z[0] for Z in coord if Z[2] == 1])
-                        max_zy = max([Z[1] for Z in coord if Z[2] == 1])
-
-                        if max_zy > min_y and not self.field[max_zy - 1][max_zx]:
-                            # двигаем вверх
-                            for i in range(4):
-                                coord[i][1] -= abs(max_y - max_zy + 1)
-                        elif max_zy < max_y and not self.field[max_zy + 1][max_zx]:
-                            # двигаем вниз
-                            for i in range(4):
-                                coord[i][1] += abs(max_zy - min_y + 1)
-
-                        for a in range(4):
-                            coord[a][2] = (1 if self.field[coord[a][1]][coord[a][0]] else 0) if (
-                                    0 <= coord[a][1] <= 19 and 0 <= coord[a][0] <= 9) else 0
-
-                        if 1 not in (c[2] for c in coord):
-                            for i in range(4):
-                                self.figure[i].x = coord[i][0]
-                                self.figure[i].y = coord[i][1]
-                                if not (0 <= coord[i][1] <= 19 and 0 <= coord[i][0] <= 9):
-                                    self.figure = deepcopy(figure_old)
-                                    break
-                        else:
-                            self.figure = deepcopy(figure_old)
-            # move y
-            if not self.anim_lines and not self.game_over and not self.pause and not self.info:
-                self.anim_count += self.anim_speed
-                if self.anim_count >= self.anim_limit or self.dy > 0:
-                    self.anim_count = 0
-                    figure_old = deepcopy(self.figure)
-                    for i in range(4):
-                        self.figure[i].y += 1
-                        if self.figure[i].y > 19 or self.field[self.figure[i].y][self.figure[i].x]:
-                            for j in range(4):
-                                # noinspection PyTypeChecker
-                                self.field[figure_old[j].y][figure_old[j].x] = self.color
-                            self.figure, self.color = self.next_figure, self.next_color
-                            self.next_figure, self.next_color = deepcopy(random.choice(self.figures)), self.random_color()
-                            self.anim_limit = FPS
-
-                            if self.sound: self.sound_place.play()
-
-                            # check game_over
-                            for t in range(4):
-                                if self.field[self.figure[t].y][self.figure[t].x]:
-                                    self.game_over = True
-                                    if self.sound: self.sound_game_over.play()
-
-                                    # anim game_over
-                                    for i_rect in self.grid:
-                                        pygame.draw.rect(self.boardSurface, self.random_color(), i_rect)
-                                        pygame.display.flip()
-                                        self.clock.tick(150)
-                                    break
-                            break
-
-            # check anim_lines
-            if not self.game_over and not self.pause and not self.info:
-                for row in range(19, -1, -1):
-                    count = 0
-                    for i in range(10):
-                        if self.field[row][i]:
-                            count += 1
-                    if count == 10:
-                        for j in range(10):
-                            # noinspection PyTypeChecker
-                            self.field[row][j] = WHITE
-                        self.anim_lines = True
-
-            line, lines = 19, 0
-            if self.anim_lines:
-                self.count_anim_lines += 1
-                if self.count_anim_lines == 10:
-                    self.count_anim_lines = 0
-                    self.anim_lines = False
-
-                    # check lines
-                    for row in range(19, -1, -1):
-                        count = 0
-                        for i in range(10):
-                            if self.field[row][i]:
-                                count += 1
-                            self.field[line][i] = self.field[row][i]
-                        if count < 10:
-                            line -= 1
-                        else:
-                            lines += 1
-
-            # score
-            old_score = self.score
-            self.score += lines
-            if lines != 0:
-                if self.sound: self.sound_line.play()
-                if self.score > self.best: self.best = self.score
-
-                next_level = False
-                s = ((i + 1) * 10 for i in range(100))
-                for e in s:
-                    if self.score >= e > old_score:
-                        next_level = True
-                        break
-
-                if next_level:
-                    self.anim_speed += 0.5
-                    self.level += 1
-                    if self.sound: self.sound_level.play()
-
-            # draw figure
-            for i in range(4):
-                self.figure_rect.x = self.figure[i].x * self.TILE
-                self.figure_rect.y = self.figure[i].y * self.TILE
-                pygame.draw.rect(self.boardSurface, self.color, self.figure_rect)
-
-            # draw field
-            for y, raw in enumerate(self.field):
-                for x, col in enumerate(raw):
-                    if col:
-                        self.figure_rect.x, self.figure_rect.y = x * self.TILE, y * self.TILE
-                        pygame.draw.rect(self.boardSurface, col, self.figure_rect)
-
-            # draw info
-            self.infoSurface.blit(self.next_text, (self.infoSurface.get_width() / 2 - self.next_text.get_width() / 2, 0))
-            self.infoSurface.blit(self.best_text, (self.infoSurface.get_width() / 2 - self.best_text.get_width() / 2, self.TILE * 6))
-            best_value = self.game_font.render(str(self.best), True, WHITE)
-            self.infoSurface.blit(best_value, (self.infoSurface.get_width() / 2 - best_value.get_width() / 2, self.TILE * 7))
-            self.infoSurface.blit(self.lines_text, (self.infoSurface.get_width() / 2 - self.lines_text.get_width() / 2, self.TILE * 9))
-            lines_value = self.game_font.render(str(self.score), True, WHITE)
-            self.infoSurface.blit(lines_value, (self.infoSurface.get_width() / 2 - lines_value.get_width() / 2, self.TILE * 10))
-            self.infoSurface.blit(self.level_text, (self.infoSurface.get_width() / 2 - self.level_text.get_width() / 2, self.TILE * 12))
-            level_value = self.game_font.render(str(self.level), True, WHITE)
-            self.infoSurface.blit(level_value, (self.infoSurface.get_width() / 2 - level_value.get_width() / 2, self.TILE * 13))
-
-            # draw button's
-            # menu button
-            pygame.draw.rect(self.infoSurface, WHITE, (self.TILE / 2, self.TILE * 19, self.TILE, self.TILE / 5))
-            pygame.draw.rect(self.infoSurface, WHITE, (self.TILE / 2, self.TILE * 19 + 2 * self.TILE / 5, self.TILE, self.TILE / 5))
-            pygame.draw.rect(self.infoSurface, WHITE, (self.TILE / 2, self.TILE * 19 + 4 * self.TILE / 5, self.TILE, self.TILE / 5))
-            # info button
-            pygame.draw.rect(self.infoSurface, WHITE, (3 * self.TILE - self.TILE / 5, self.TILE * 19, 2 * self.TILE / 5, self.TILE / 5))
-            pygame.draw.rect(self.infoSurface, WHITE,
-                             (3 * self.TILE - 2 * self.TILE / 5, self.TILE * 19 + 2 * self.TILE / 5, 2 * self.TILE / 5, self.TILE / 5 / 2))
-            pygame.draw.rect(self.infoSurface, WHITE,
-                             (3 * self.TILE - self.TILE / 5, self.TILE * 19 + 2 * self.TILE / 5, 2 * self.TILE / 5, 3 * self.TILE / 5))
-            pygame.draw.rect(self.infoSurface, WHITE,
-                             (2 * self.TILE + self.TILE / 2, self.TILE * 19 + self.TILE - self.TILE / 5 / 2, self.TILE, self.TILE / 5 / 2))
-
-            # draw next figure
-            for i in range(4):
-                self.figure_rect.x = self.next_figure[i].x * self.TILE - self.TILE * 3
-                self.figure_rect.y = self.next_figure[i].y * self.TILE + self.TILE
-                pygame.draw.rect(self.infoSurface, self.next_color, self.figure_rect)
-
-            if self.game_over:
-                pygame.draw.rect(self.boardSurface, BLACK, (1, self.TILE * 9, self.TILE * 10 - 2, self.TILE * 3))
-                self.boardSurface.blit(self.gameover_text,
-                                       (self.boardSurface.get_width() / 2 - self.gameover_text.get_width() / 2,
-                                        self.TILE * 10 + self.TILE * 0.15))
-
-            if self.info:
-                pygame.draw.rect(self.boardSurface, BLACK, (1, self.TILE * 2, self.TILE * 10 - 2, self.TILE * 16))
-                for i, row in enumerate(self.info_text):
-                    info_render = self.info_font.render(row, True, WHITE)
-                    self.boardSurface.blit(info_render, (self.boardSurface.get_width() / 2 - info_render.get_width() / 2,
-                                                         self.TILE * 2 + info_render.get_height() * (i + 1) * 1.5))
-
-            if self.pause:
-                pygame.draw.rect(self.boardSurface, BLACK, (1, self.TILE * 7, self.TILE * 10 - 2, self.TILE * 7))
-                self.boardSurface.blit(self.select_symbol, (self.TILE, self.TILE * (7 + self.select) + self.TILE * 0.15))
-                self.boardSurface.blit(self.resume_text,
-                                       (self.boardSurface.get_width() / 2 - self.resume_text.get_width() / 2, self.TILE * 8 + self.TILE * 0.15))
-                self.boardSurface.blit(self.newgame_text,
-                                       (self.boardSurface.get_width() / 2 - self.newgame_text.get_width() / 2, self.TILE * 9 + self.TILE * 0.15))
-                self.boardSurface.blit(self.music_text,
-                                       (self.boardSurface.get_width() / 2 - self.music_text.get_width() / 2, self.TILE * 10 + self.TILE * 0.15))
-                self.boardSurface.blit(self.sound_text,
-                                       (self.boardSurface.get_width() / 2 - self.sound_text.get_width() / 2, self.TILE * 11 + self.TILE * 0.15))
-                self.boardSurface.blit(self.exit_text,
-                                       (self.boardSurface.get_width() / 2 - self.exit_text.get_width() / 2, self.TILE * 12 + self.TILE * 0.15))
+            self.frame(events)
+            if self.idle():
+                # спать до события или до следующего кадра фона вместо FPS кадров в секунду
+                event = pygame.event.wait(1000 // IDLE_FPS if IDLE_FPS else 0)
+                events = [event] + pygame.event.get() if event.type != pygame.NOEVENT else []
+                # кадр по событию не двигает фон: время ожидания не должно догоняться шагами игры
+                self.frame_ms = 0 if events else self.clock.tick()
+                if events: self.clock.tick()
+            else:
+                events = None
+                self.frame_ms = self.clock.tick(FPS)
+
+    def frame(self, events=None):
+        """Handle the events (pending ones by default), advance the simulation by frame_ms and draw one frame"""
+        timer = self.timer
+        if timer: timer.start()
+
+        # События: обработчик по типу, прочие типы не доходят до Python (set_allowed)
+        handlers = self.handlers
+        for event in pygame.event.get() if events is None else events:
+            # любое нажатие досрочно завершает анимации
+            if self.effects and event.type in (pygame.KEYDOWN, pygame.JOYBUTTONDOWN, pygame.MOUSEBUTTONDOWN):
+                self.skip_effects()
+            handler = handlers.get(event.type)
+            if handler: handler(event)
+
+        if timer: timer.mark('events')
+
+        # Графика
+        self.windowSurface.fill(BLACK)
+
+        # Нанесение на поверхность белых прямоугольников - снега ;)
+        if self.dirty_rects: self.dirty.extend(self.stars.rects)
+        self.stars.update(self.frame_ms)
+        self.stars.draw()
+        if self.dirty_rects: self.dirty.extend(self.stars.rects)
+        if timer: timer.mark('stars')
+
+        # draw grid
+        if self.layers_tile != self.TILE: self.build_layers()
+        self.boardSurface.blit(self.board_layer, (0, 0))
+        if timer: timer.mark('grid')
+
+        # touch
+        if self.block:
+            self.block_ms += self.frame_ms
+            if self.block_ms >= TOUCH_BLOCK_MS:
+                self.block_ms = 0
+                self.block = False
+
+        # шаги симуляции за прошедшее время кадра
+        if not self.pause and not self.info:
+            self.accumulator = min(self.accumulator + self.frame_ms, MAX_FRAME_MS)
+            while self.accumulator >= TICK_MS:
+                self.accumulator -= TICK_MS
+                self.tick()
+        else:
+            self.accumulator = 0
+            self.inputs = 0
+        if timer: timer.mark('logic')
+
+        # draw ghost: контур фигуры на месте падения
+        piece = self.engine.piece
+        if self.engine.game_over:
+            self.ghost_y = piece.y
+        else:
+            self.ghost_y = self.engine.landing_y()
+            for x, y in piece.cells():
+                self.figure_rect.x = x * self.TILE
+                self.figure_rect.y = (y + self.ghost_y - piece.y) * self.TILE
+                pygame.draw.rect(self.boardSurface, self.engine.color, self.figure_rect, max(1, self.TILE // 12))
+
+        # draw figure
+        for x, y in piece.cells():
+            self.figure_rect.x = x * self.TILE
+            self.figure_rect.y = y * self.TILE
+            pygame.draw.rect(self.boardSurface, self.engine.color, self.figure_rect)
+
+        # draw field
+        for y, raw in enumerate(self.engine.field):
+            for x, col in enumerate(raw):
+                if col:
+                    self.figure_rect.x, self.figure_rect.y = x * self.TILE, y * self.TILE
+                    pygame.draw.rect(self.boardSurface, col, self.figure_rect)
+
+        # effects
+        if self.effects:
+            for effect in self.effects:
+                effect.update(self.frame_ms)
+                effect.draw(self.boardSurface)
+            self.effects = [effect for effect in self.effects if not effect.done]
+            if self.dirty_rects: self.dirty.append(self.board_rect)
+        if timer: timer.mark('field')
+
+        # draw info
+        self.infoSurface.blit(self.info_layer, (0, 0))
+        best_value = self.text_cache.render(self.game_font, str(self.engine.best), WHITE)
+        self.infoSurface.blit(best_value, (self.infoSurface.get_width() / 2 - best_value.get_width() / 2, self.TILE * 7))
+        lines_value = self.text_cache.render(self.game_font, str(self.engine.score), WHITE)
+        self.infoSurface.blit(lines_value, (self.infoSurface.get_width() / 2 - lines_value.get_width() / 2, self.TILE * 10))
+        level_value = self.text_cache.render(self.game_font, str(self.engine.level), WHITE)
+        self.infoSurface.blit(level_value, (self.infoSurface.get_width() / 2 - level_value.get_width() / 2, self.TILE * 13))
+
+        # draw next figure
+        for x, y in self.engine.next_piece.cells():
+            self.figure_rect.x = x * self.TILE - self.TILE * 3
+            self.figure_rect.y = y * self.TILE + self.TILE
+            pygame.draw.rect(self.infoSurface, self.engine.next_color, self.figure_rect)
+
+        if self.engine.game_over and not self.effects:
+            pygame.draw.rect(self.boardSurface, BLACK, (1, self.TILE * 9, self.TILE * 10 - 2, self.TILE * 3))
+            self.boardSurface.blit(self.gameover_text,
+                                   (self.boardSurface.get_width() / 2 - self.gameover_text.get_width() / 2,
+                                    self.TILE * 10 + self.TILE * 0.15))
+
+        if self.info:
+            self.boardSurface.blit(self.info_overlay, (1, self.TILE * 2))
 
+        if self.pause:
+            pygame.draw.rect(self.boardSurface, BLACK, (1, self.TILE * 7, self.TILE * 10 - 2, self.TILE * 7))
+            self.boardSurface.blit(self.select_symbol, (self.TILE, self.TILE * (7 + self.select) + self.TILE * 0.15))
+            self.boardSurface.blit(self.resume_text,
+                                   (self.boardSurface.get_width() / 2 - self.resume_text.get_width() / 2, self.TILE * 8 + self.TILE * 0.15))
+            self.boardSurface.blit(self.newgame_text,
+                                   (self.boardSurface.get_width() / 2 - self.newgame_text.get_width() / 2, self.TILE * 9 + self.TILE * 0.15))
+            self.boardSurface.blit(self.music_text,
+                                   (self.boardSurface.get_width() / 2 - self.music_text.get_width() / 2, self.TILE * 10 + self.TILE * 0.15))
+            self.boardSurface.blit(self.sound_text,
+                                   (self.boardSurface.get_width() / 2 - self.sound_text.get_width() / 2, self.TILE * 11 + self.TILE * 0.15))
+            self.boardSurface.blit(self.exit_text,
+                                   (self.boardSurface.get_width() / 2 - self.exit_text.get_width() / 2, self.TILE * 12 + self.TILE * 0.15))
+
+        if self.hud:
+            self.draw_hud()
+        if timer: timer.mark('text')
+
+        if self.dirty_rects:
+            self.update_display()
+        else:
             pygame.display.flip()
-            self.clock.tick(FPS)
+            self.pixels_pushed = self.window_area
+        if timer: timer.mark('flip')
 
 
 if __name__ == '__main__':
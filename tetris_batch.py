@@ -0,0 +1,193 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+"""Batched rules: N boards as an (N, 20) array of row masks, every step applied to all of them with NumPy"""
+
+import sys
+import time
+
+import numpy
+
+from tetris_engine import (SHAPES, KICKS, FULL_ROW, GRAVITY_TICKS, INPUT_LEFT, INPUT_RIGHT, INPUT_DOWN, INPUT_ROTATE,
+                           INPUT_DROP, spawn)
+
+
+def build_tables():
+    """Pad the orientation and kick tables of the engine into arrays indexed by [id, rotation]"""
+    kick_count = max(len(offsets) for fig_kicks in KICKS for offsets in fig_kicks)
+    cells = numpy.zeros((len(SHAPES), 4, 4, 2), dtype=numpy.int16)
+    kicks = numpy.zeros((len(SHAPES), 4, kick_count, 2), dtype=numpy.int16)
+    for figure_id, orients in enumerate(SHAPES):
+        for rot in range(4):
+            # у квадрата одно положение: поворот оставляет его на месте
+            cells[figure_id, rot] = orients[rot % len(orients)]
+            offsets = KICKS[figure_id][rot % len(orients)]
+            # короткие списки дополняются последним сдвигом - повторная проверка ничего не меняет
+            kicks[figure_id, rot] = offsets + offsets[-1:] * (kick_count - len(offsets))
+    rot_count = numpy.array([len(orients) for orients in SHAPES], dtype=numpy.int16)
+    start = numpy.array([spawn(figure_id) for figure_id in range(len(SHAPES))], dtype=numpy.int16)
+    return cells, kicks, rot_count, start
+
+
+# CELLS[id, rot] - клетки, KICK_TABLE[id, rot] - сдвиги после поворота, ROT_COUNT[id], SPAWN[id] - (x, y) центра
+CELLS, KICK_TABLE, ROT_COUNT, SPAWN = build_tables()
+BITS = numpy.arange(16, dtype=numpy.uint16)
+
+
+class BatchEngine:
+    """N games in lockstep; lines clear on lock, without the flashing delay of TetrisEngine"""
+
+    def __init__(self, n, seed=None):
+        self.n = n
+        self.rng = numpy.random.default_rng(seed)
+        self.rows = numpy.zeros((n, 20), dtype=numpy.uint16)
+        self.figure_id = numpy.zeros(n, dtype=numpy.int16)
+        self.next_id = numpy.zeros(n, dtype=numpy.int16)
+        self.rot = numpy.zeros(n, dtype=numpy.int16)
+        self.x = numpy.zeros(n, dtype=numpy.int16)
+        self.y = numpy.zeros(n, dtype=numpy.int16)
+        self.anim_count = numpy.zeros(n, dtype=numpy.float32)
+        self.anim_speed = numpy.zeros(n, dtype=numpy.float32)
+        self.score = numpy.zeros(n, dtype=numpy.int32)
+        self.level = numpy.zeros(n, dtype=numpy.int32)
+        self.pieces = numpy.zeros(n, dtype=numpy.int32)
+        self.game_over = numpy.zeros(n, dtype=bool)
+        self.new_games(numpy.arange(n))
+
+    def new_games(self, idx):
+        """Start new games on the boards idx"""
+        self.rows[idx] = 0
+        self.figure_id[idx] = self.rng.integers(0, len(SHAPES), idx.size, dtype=numpy.int16)
+        self.next_id[idx] = self.rng.integers(0, len(SHAPES), idx.size, dtype=numpy.int16)
+        self.rot[idx] = 0
+        self.x[idx], self.y[idx] = SPAWN[self.figure_id[idx]].T
+        self.anim_count[idx] = 0
+        self.anim_speed[idx] = 1
+        self.score[idx] = 0
+        self.level[idx] = 1
+        self.pieces[idx] = 0
+        self.game_over[idx] = False
+
+    def fits(self, idx, figure_id, rot, x, y):
+        """Boolean array: figures of the boards idx stay inside their fields and free cells"""
+        cells = CELLS[figure_id, rot]
+        cx, cy = x[:, None] + cells[..., 0], y[:, None] + cells[..., 1]
+        inside = (cx >= 0) & (cx <= 9) & (cy >= 0) & (cy <= 19)
+        masks = self.rows[idx[:, None], numpy.clip(cy, 0, 19)]
+        taken = masks >> numpy.clip(cx, 0, 9).astype(numpy.uint16) & 1
+        return numpy.all(inside & (taken == 0), axis=1)
+
+    def step(self, inputs=0):
+        """Advance every board by one tick with INPUT_* flags (scalar or per board), return lines cleared per board"""
+        inputs = numpy.broadcast_to(numpy.asarray(inputs, dtype=numpy.uint8), (self.n,))
+        live = numpy.flatnonzero(~self.game_over)
+        inputs = inputs[live]
+        fid, rot, x, y = self.figure_id[live], self.rot[live], self.x[live], self.y[live]
+
+        # move x
+        dx = numpy.where(inputs & INPUT_RIGHT, 1, numpy.where(inputs & INPUT_LEFT, -1, 0)).astype(numpy.int16)
+        moving = numpy.flatnonzero(dx)
+        if moving.size:
+            nx = x[moving] + dx[moving]
+            ok = self.fits(live[moving], fid[moving], rot[moving], nx, y[moving])
+            x[moving[ok]] = nx[ok]
+
+        # rotate: первый подходящий сдвиг из таблицы
+        turning = numpy.flatnonzero((inputs & INPUT_ROTATE) != 0)
+        if turning.size:
+            tf = fid[turning]
+            nrot = (rot[turning] + 1) % ROT_COUNT[tf]
+            pending = numpy.ones(turning.size, dtype=bool)
+            for k in range(KICK_TABLE.shape[2]):
+                todo = numpy.flatnonzero(pending)
+                if not todo.size:
+                    break
+                kick = KICK_TABLE[tf[todo], nrot[todo], k]
+                nx, ny = x[turning[todo]] + kick[:, 0], y[turning[todo]] + kick[:, 1]
+                ok = self.fits(live[turning[todo]], tf[todo], nrot[todo], nx, ny)
+                done = turning[todo[ok]]
+                rot[done], x[done], y[done] = nrot[todo[ok]], nx[ok], ny[ok]
+                pending[todo[ok]] = False
+
+        # drop: вниз, пока помещается
+        dropping = numpy.flatnonzero((inputs & INPUT_DROP) != 0)
+        while dropping.size:
+            ok = self.fits(live[dropping], fid[dropping], rot[dropping], x[dropping], y[dropping] + 1)
+            dropping = dropping[ok]
+            y[dropping] += 1
+
+        # move y: сила тяжести, шаг вниз по клавише, сброшенные фигуры сразу фиксируются
+        count = self.anim_count[live] + self.anim_speed[live]
+        falling = (count >= GRAVITY_TICKS) | ((inputs & (INPUT_DOWN | INPUT_DROP)) != 0)
+        count[falling] = 0
+        self.anim_count[live] = count
+        self.figure_id[live], self.rot[live], self.x[live], self.y[live] = fid, rot, x, y
+
+        lines = numpy.zeros(self.n, dtype=numpy.int32)
+        fall = live[falling]
+        if fall.size:
+            ok = self.fits(fall, self.figure_id[fall], self.rot[fall], self.x[fall], self.y[fall] + 1)
+            self.y[fall[ok]] += 1
+            locking = fall[~ok]
+            if locking.size:
+                lines[locking] = self.lock(locking)
+        return lines
+
+    def lock(self, idx):
+        """Fix the figures of the boards idx, clear their full rows, bring in the next figures; return lines"""
+        cells = CELLS[self.figure_id[idx], self.rot[idx]]
+        cx, cy = self.x[idx, None] + cells[..., 0], self.y[idx, None] + cells[..., 1]
+        numpy.bitwise_or.at(self.rows, (numpy.repeat(idx, 4), cy.ravel()), (1 << cx.ravel()).astype(numpy.uint16))
+        self.pieces[idx] += 1
+
+        # check lines: полные строки уходят наверх устойчивой сортировкой и обнуляются
+        rows = self.rows[idx]
+        full = rows == FULL_ROW
+        lines = full.sum(axis=1)
+        cleared = numpy.flatnonzero(lines)
+        if cleared.size:
+            order = numpy.argsort(~full[cleared], axis=1, kind='stable')
+            kept = numpy.take_along_axis(rows[cleared], order, axis=1)
+            kept[numpy.arange(20) < lines[cleared, None]] = 0
+            self.rows[idx[cleared]] = kept
+
+            # каждые 10 линий - новый уровень
+            old = self.score[idx]
+            self.score[idx] += lines
+            level_up = (self.score[idx] // 10 > old // 10) & (old < 1000)
+            self.level[idx[level_up]] += 1
+            self.anim_speed[idx[level_up]] += 0.5
+
+        # следующая фигура; не поместилась - game over
+        self.figure_id[idx] = self.next_id[idx]
+        self.next_id[idx] = self.rng.integers(0, len(SHAPES), idx.size, dtype=numpy.int16)
+        self.rot[idx] = 0
+        self.x[idx], self.y[idx] = SPAWN[self.figure_id[idx]].T
+        fits = self.fits(idx, self.figure_id[idx], self.rot[idx], self.x[idx], self.y[idx])
+        self.game_over[idx[~fits]] = True
+        return lines
+
+    def cells(self, board):
+        """Field occupancy of one board as a (20, 10) uint8 array"""
+        return (self.rows[board][:, None] >> BITS[:10] & 1).astype(numpy.uint8)
+
+
+if __name__ == '__main__':
+    # python tetris_batch.py [boards] [ticks]: случайные входы на всех досках, законченные игры начинаются заново
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    ticks = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    batch = BatchEngine(n, 0)
+    choices = numpy.array([0, 0, 0, INPUT_LEFT, INPUT_RIGHT, INPUT_DOWN, INPUT_ROTATE, INPUT_DROP], dtype=numpy.uint8)
+    inputs = choices[numpy.random.default_rng(1).integers(0, len(choices), (64, n))]
+    games = pieces = lines = 0
+    start = time.perf_counter()
+    for tick in range(ticks):
+        lines += batch.step(inputs[tick & 63]).sum()
+        over = numpy.flatnonzero(batch.game_over)
+        if over.size:
+            games += over.size
+            pieces += batch.pieces[over].sum()
+            batch.new_games(over)
+    elapsed = time.perf_counter() - start
+    print('%d boards x %d ticks: %.0f board-steps/s, %d games over, %d pieces, %d lines'
+          % (n, ticks, n * ticks / elapsed, games, pieces + batch.pieces.sum(), lines))
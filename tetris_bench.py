@@ -0,0 +1,215 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+"""Micro-benchmarks of the tetris engine and per-phase frame timings of the game"""
+
+from copy import deepcopy
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+from tetris_engine import TetrisEngine, Piece, TICK_MS, INPUT_LEFT, INPUT_RIGHT, INPUT_DOWN, INPUT_ROTATE, INPUT_DROP
+
+
+def bench_piece(number=100000):
+    """Compare a deepcopy move/rollback with the in-place Piece and count pieces created in steady state"""
+    engine = TetrisEngine(0)
+
+    # прежний способ: копия фигуры перед каждым ходом и откат копией
+    figure = [list(cell) for cell in engine.piece.cells()]
+
+    def deepcopy_move():
+        nonlocal figure
+        figure_old = deepcopy(figure)
+        for cell in figure:
+            cell[0] += 1
+        figure = deepcopy(figure_old)
+
+    def piece_move():
+        p = engine.piece
+        p.x += 1
+        engine.fits(p.figure_id, p.rot, p.x, p.y)
+        p.x -= 1
+
+    print('move + rollback, deepcopy: %.3f us' % (timeit.timeit(deepcopy_move, number=number) / number * 1e6))
+    print('move + rollback, Piece:    %.3f us' % (timeit.timeit(piece_move, number=number) / number * 1e6))
+
+    # установившийся режим: зажатые клавиши, падение и фиксация фигур
+    rng = random.Random(1)
+    inputs = [rng.choice((0, INPUT_LEFT, INPUT_RIGHT, INPUT_DOWN, INPUT_ROTATE)) for i in range(1024)]
+    created, ticks = Piece.created, number
+    for tick in range(ticks):
+        engine.step(inputs[tick & 1023])
+        if engine.game_over:
+            engine.new_game()
+            created += 2  # new_game создает две фигуры
+    print('pieces created in %d ticks: %d' % (ticks, Piece.created - created))
+
+
+def bench_snapshot(number=20000):
+    """Compare snapshot()/restore() of the engine state with a deepcopy of the engine"""
+    engine = TetrisEngine(0)
+    for tick in range(300):
+        engine.step(INPUT_DROP if tick % 20 == 0 else 0)
+    snapshot = engine.snapshot()
+    print('deepcopy:  %.3f us' % (timeit.timeit(lambda: deepcopy(engine), number=number // 10) / (number // 10) * 1e6))
+    print('snapshot:  %.3f us' % (timeit.timeit(engine.snapshot, number=number) / number * 1e6))
+    print('restore:   %.3f us' % (timeit.timeit(lambda: engine.restore(snapshot), number=number) / number * 1e6))
+
+
+def bench_stars(counts=(120, 1000, 5000), frames=300):
+    """Per-frame cost of the starfield: NumPy arrays against the list loop"""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    from pygame_tetris import StarField
+
+    pygame.display.init()
+    surface = pygame.display.set_mode((1920, 1080))
+    for count in counts:
+        for use_numpy in (False, True):
+            stars = StarField(surface, count, use_numpy)
+            start = time.perf_counter()
+            for i in range(frames):
+                stars.update(TICK_MS)
+                stars.draw()
+            elapsed = time.perf_counter() - start
+            print('stars %5d, %-5s: %.3f ms/frame' % (count, 'numpy' if stars.use_numpy else 'list',
+                                                     elapsed / frames * 1e3))
+    pygame.display.quit()
+
+
+def scenario_idle(game, frame):
+    """The figure falls by gravity alone"""
+
+
+def scenario_keys(game, frame):
+    """Keys are held and released in turn"""
+    import pygame
+    key = (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN)[frame // 40 % 4]
+    if frame % 40 == 0:
+        pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=key, mod=0, unicode='', scancode=0))
+    elif frame % 40 == 30:
+        pygame.event.post(pygame.event.Event(pygame.KEYUP, key=key, mod=0, unicode='', scancode=0))
+
+
+def scenario_info(game, frame):
+    """The info screen is open"""
+    if frame == 0: game.get_info()
+
+
+def scenario_pause(game, frame):
+    """The pause menu is open and the selection moves"""
+    if frame == 0: game.get_pause()
+    if frame % 30 == 0: game.key_down()
+
+
+def scenario_lines(game, frame):
+    """A near-full board with a line clear as soon as the previous one is over"""
+    engine = game.engine
+    if engine.game_over:
+        engine.new_game(frame)
+    if not engine.anim_lines:
+        field = [[0] * 10 for y in range(20)]
+        for y in range(12, 20):
+            for x in range(10):
+                # четыре полные строки внизу, выше - строки с дырой
+                if y >= 16 or x != y % 10:
+                    field[y][x] = (200, 100 + y * 5, 150)
+        engine.set_field(field)
+        game.drop()
+
+
+SCENARIOS = {
+    'idle': scenario_idle,
+    'keys': scenario_keys,
+    'info': scenario_info,
+    'pause': scenario_pause,
+    'lines': scenario_lines,
+}
+
+
+def summary(values):
+    """Mean and p50/p95/p99 of a list of milliseconds"""
+    q = statistics.quantiles(values, n=100, method='inclusive')
+    return {'mean': statistics.fmean(values), 'p50': q[49], 'p95': q[94], 'p99': q[98], 'max': max(values)}
+
+
+def bench_frames(frames=600, names=None):
+    """Drive the whole game under the SDL dummy drivers through the scenarios, return frame and phase timings and pixels pushed"""
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'  # stdout - только JSON
+    # сохранения игры - во временный каталог, удаляется после прогона
+    home = tempfile.TemporaryDirectory()
+    os.environ['HOME'] = os.environ['USERPROFILE'] = home.name
+    import pygame
+    from pygame_tetris import Game, FrameTimer
+
+    results = {}
+    for name in names or SCENARIOS:
+        scenario = SCENARIOS[name]
+        game = Game()
+        game.engine.new_game(0)
+        game.pause = game.info = False
+        pixels = []
+        for frame in range(frames):
+            # прогрев: кеш текста, слои, первый полный вывод
+            if frame == frames // 10: game.timer = FrameTimer(frames)
+            scenario(game, frame)
+            game.frame()
+            if game.timer: pixels.append(game.pixels_pushed)
+            game.frame_ms = TICK_MS  # шаги симуляции как при ровных 60 FPS, без ожидания clock
+        timer = game.timer
+        results[name] = dict(summary(timer.values()), frames=timer.count, pixels=statistics.fmean(pixels),
+                             phases={phase: summary(timer.values(phase)) for phase in timer.PHASES})
+        game.saver.close()
+        pygame.quit()
+    home.cleanup()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the scenarios whose p50 or p95 grew beyond the baseline by more than tolerance, return their number"""
+    slower = 0
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key in ('p50', 'p95'):
+            before, after = baseline[name][key], result[key]
+            if after > before * (1 + tolerance):
+                print('%s %s: %.3f ms -> %.3f ms (+%.0f%%)' % (name, key, before, after, (after / before - 1) * 100),
+                      file=sys.stderr)
+                slower += 1
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=600, help='frames per scenario')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='run only these scenarios')
+    parser.add_argument('--save', metavar='FILE', help='store the frame timings as a baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='fail when frames got slower than in this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline')
+    parser.add_argument('--micro', action='store_true', help='run the engine and starfield micro-benchmarks instead')
+    args = parser.parse_args()
+
+    if args.micro:
+        bench_piece()
+        bench_snapshot()
+        bench_stars()
+        sys.exit(0)
+
+    results = bench_frames(args.frames, args.scenario)
+    print(json.dumps(results, indent=2))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            sys.exit(1 if compare(results, json.load(f), args.tolerance) else 0)
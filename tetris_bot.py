@@ -0,0 +1,185 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+"""Autoplayer: placement search over the row masks with a weighted board evaluation"""
+
+from collections import OrderedDict
+import sys
+import time
+
+from tetris_engine import (TetrisEngine, SHAPES, FULL_ROW, INPUT_LEFT, INPUT_RIGHT, INPUT_ROTATE, INPUT_DROP, spawn,
+                           fits, kick, landing_y)
+
+
+# const
+# веса оценки поля: суммарная высота столбцов, убранные линии, дыры под блоками, перепады соседних столбцов
+WEIGHTS = {'height': -0.510066, 'lines': 0.760666, 'holes': -0.35663, 'bumpiness': -0.184483}
+BEAM = 4  # лучших мест текущей фигуры, для которых перебирается следующая
+STEP_BOARDS = 24  # полей, оцениваемых за шаг движка: перебор идет несколько шагов, пока фигура ждет
+MAX_MOVES = 12  # ходов к цели, после которых фигура сбрасывается как есть
+CACHE_SIZE = 2000  # оценок полей в памяти, вытесняются давно не нужные: совпадения - в пределах одного выбора
+
+
+def features(rows):
+    """Return (heights, aggregate height, holes, bumpiness) of a board of row masks"""
+    heights = [0] * 10
+    covered = holes = 0
+    for y, mask in enumerate(rows):
+        if covered:
+            holes += bin(covered & ~mask).count('1')
+        new = mask & ~covered
+        while new:
+            low = new & -new
+            heights[low.bit_length() - 1] = 20 - y
+            new ^= low
+        covered |= mask
+    bumpiness = sum(abs(a - b) for a, b in zip(heights, heights[1:]))
+    # только кортежи чисел: сборщик мусора перестает обходить записи кеша
+    return tuple(heights), sum(heights), holes, bumpiness
+
+
+def place(rows, figure_id, rot, x, y):
+    """Lock a figure into a copy of the row masks and remove full rows, return (rows, lines)"""
+    rows = rows[:]
+    for dx, dy in SHAPES[figure_id][rot]:
+        rows[y + dy] |= 1 << x + dx
+    kept = [mask for mask in rows if mask != FULL_ROW]
+    lines = 20 - len(kept)
+    return [0] * lines + kept, lines
+
+
+def placements(rows, heights, figure_id):
+    """Yield (rot, x, y) of every spot reached by rotating at the spawn position, sliding and dropping"""
+    x, y = spawn(figure_id)
+    if not fits(rows, figure_id, 0, x, y):
+        return
+    for rot in range(len(SHAPES[figure_id])):
+        # поворот и падение - функциями движка, места совпадают с тем, что сделает игра
+        if rot:
+            pos = kick(rows, figure_id, rot, x, y)
+            if pos is None:
+                return
+            x, y = pos
+        for step, cx in ((-1, x), (1, x + 1)):
+            while fits(rows, figure_id, rot, cx, y):
+                yield rot, cx, landing_y(rows, heights, figure_id, rot, cx, y)
+                cx += step
+
+
+class Bot:
+    """Chooses a placement for every new figure and returns the player inputs that lead to it"""
+
+    def __init__(self, engine, weights=WEIGHTS, beam=BEAM, step_boards=STEP_BOARDS):
+        self.engine = engine
+        self.weights = weights
+        self.beam = beam
+        self.step_boards = step_boards
+        self.cache = OrderedDict()  # tuple масок строк -> (heights, высота, дыры, перепады)
+        self.hits = self.misses = 0
+        self.key = None  # фигура, для которой выбрана цель
+        self.search = None  # незаконченный перебор мест
+        self.target = None
+        self.moves = 0
+
+    def board(self, rows):
+        key = tuple(rows)
+        result = self.cache.get(key)
+        if result is None:
+            self.misses += 1
+            result = self.cache[key] = features(rows)
+            if len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self.cache.move_to_end(key)
+        return result
+
+    def score(self, rows, lines):
+        w = self.weights
+        heights, height, holes, bumpiness = self.board(rows)
+        return w['height'] * height + w['lines'] * lines + w['holes'] * holes + w['bumpiness'] * bumpiness
+
+    def plan(self):
+        """Search the best (rot, x) into self.target, looking at the next figure too; yield every step_boards boards"""
+        engine = self.engine
+        rows = engine.rows
+        figure_id, next_id = engine.piece.figure_id, engine.next_piece.figure_id
+        budget = self.step_boards
+        first = []
+        for rot, x, y in placements(rows, engine.heights, figure_id):
+            after, lines = place(rows, figure_id, rot, x, y)
+            first.append((self.score(after, lines), rot, x, after, lines))
+            budget -= 1
+            if not budget:
+                yield
+                budget = self.step_boards
+        if not first:
+            self.target = None
+            return
+        first.sort(key=lambda item: item[0], reverse=True)
+
+        # следующая фигура - только для лучших мест текущей
+        best, self.target = None, first[0][1:3]
+        for score, rot, x, after, lines in first[:self.beam]:
+            heights = self.board(after)[0]
+            for rot2, x2, y2 in placements(after, heights, next_id):
+                final, lines2 = place(after, next_id, rot2, x2, y2)
+                value = self.score(final, lines + lines2)
+                if best is None or value > best:
+                    best, self.target = value, (rot, x)
+                budget -= 1
+                if not budget:
+                    yield
+                    budget = self.step_boards
+
+    def inputs(self):
+        """INPUT_* flags for the next step: none while searching, then one rotation or move per step and the drop"""
+        engine = self.engine
+        if engine.game_over or engine.anim_lines:
+            return 0
+        # новая фигура после каждой фиксации и в новой игре: каждая фиксация - две выборки генератора
+        key = (engine.seed, engine.draws)
+        if key != self.key:
+            self.key = key
+            self.search = self.plan()
+            self.moves = 0
+        if self.search is not None:
+            # перебор по частям: ни один шаг не занят им дольше step_boards оценок
+            if next(self.search, self) is not self:
+                return 0
+            self.search = None
+        if self.target is None:
+            return INPUT_DROP
+
+        p = engine.piece
+        rot, x = self.target
+        self.moves += 1
+        if self.moves > MAX_MOVES:
+            return INPUT_DROP
+        if p.rot != rot:
+            return INPUT_ROTATE
+        if p.x < x:
+            return INPUT_RIGHT
+        if p.x > x:
+            return INPUT_LEFT
+        return INPUT_DROP
+
+
+if __name__ == '__main__':
+    # headless: python tetris_bot.py [games] [max lines] - линии за игру и время бота на шаг движка
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    max_lines = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    for seed in range(games):
+        engine = TetrisEngine(seed)
+        bot = Bot(engine)
+        times = []
+        while not engine.game_over and engine.score < max_lines:
+            start = time.perf_counter()
+            inputs = bot.inputs()
+            times.append(time.perf_counter() - start)
+            engine.step(inputs)
+        mean = sum(times) / len(times)
+        times.sort()
+        print('seed %d: %d lines, level %d, step %.3f ms mean / %.2f ms p99 / %.2f ms max, cache %d%% hits'
+              % (seed, engine.score, engine.level, mean * 1e3, times[len(times) * 99 // 100] * 1e3, times[-1] * 1e3,
+                 bot.hits * 100 // max(1, bot.hits + bot.misses)))
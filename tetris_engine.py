@@ -0,0 +1,488 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+"""Display-free tetris rules: no SDL surfaces, fonts or mixer"""
+
+from array import array
+from collections import namedtuple
+import random
+import sys
+import time
+
+
+# const
+FPS = 60  # тиков симуляции в секунду
+TICK_MS = 1000 / FPS  # фиксированный шаг симуляции
+
+# Время в миллисекундах, в шагах симуляции - *_TICKS
+GRAVITY_MS = 1000  # падение на клетку на первом уровне
+LINES_MS = 167  # анимация исчезновения линий
+FLASH = (250, 250, 250)  # цвет исчезающих линий
+FULL_ROW = (1 << 10) - 1  # битовая маска заполненной строки
+EMPTY_ROW = (0,) * 10  # строка цветов пустого поля
+
+
+def ms_to_ticks(ms):
+    return max(1, round(ms / TICK_MS))
+
+
+GRAVITY_TICKS = ms_to_ticks(GRAVITY_MS)
+LINES_TICKS = ms_to_ticks(LINES_MS)
+
+# Фигуры
+FIGURES_POS = [[(-1, 0), (-2, 0), (0, 0), (1, 0)],
+               [(0, -1), (-1, -1), (-1, 0), (0, 0)],
+               [(-1, 0), (-1, 1), (0, 0), (0, -1)],
+               [(0, 0), (-1, 0), (0, 1), (-1, -1)],
+               [(0, 0), (0, -1), (0, 1), (-1, -1)],
+               [(-1, 0), (-1, -1), (-1, 1), (0, -1)],
+               [(0, 0), (0, -1), (0, 1), (-1, 0)]]
+
+
+def build_tables():
+    """Precompute every orientation of each figure, its wall-kick offsets and its bottom cells"""
+    shapes, kicks, bottoms = [], [], []
+    for fig_pos in FIGURES_POS:
+        # смещения клеток от первой клетки фигуры - центра вращения
+        x0, y0 = fig_pos[0]
+        cells = tuple((x - x0, y - y0) for x, y in fig_pos)
+        orients = [cells]
+
+        # квадрат не вращать !!!
+        xs, ys = [dx for dx, dy in cells], [dy for dx, dy in cells]
+        if not (max(xs) - min(xs) == 1 and max(ys) - min(ys) == 1):
+            for r in range(3):
+                cells = tuple((-dy, dx) for dx, dy in cells)
+                orients.append(cells)
+        shapes.append(orients)
+
+        # сдвиги после поворота: на месте, влево/вправо, вверх, вниз - не дальше размеров фигуры
+        fig_kicks = []
+        for cells in orients:
+            reach = max(abs(dx) for dx, dy in cells)
+            up, down = max(dy for dx, dy in cells), -min(dy for dx, dy in cells)
+            offsets = [(0, 0)]
+            for d in range(1, reach + 1):
+                offsets += [(-d, 0), (d, 0)]
+            offsets += [(0, -d) for d in range(1, up + 1)]
+            offsets += [(0, d) for d in range(1, down + 1)]
+            fig_kicks.append(tuple(offsets))
+        kicks.append(fig_kicks)
+
+        # нижняя клетка в каждом столбце фигуры - по ней фигура встает на поле
+        fig_bottoms = []
+        for cells in orients:
+            lowest = {}
+            for dx, dy in cells:
+                lowest[dx] = max(dy, lowest.get(dx, dy))
+            fig_bottoms.append(tuple(sorted(lowest.items())))
+        bottoms.append(fig_bottoms)
+    return shapes, kicks, bottoms
+
+
+# SHAPES[id][rotation] - клетки фигуры, KICKS[id][rotation] - пробные сдвиги после поворота,
+# BOTTOMS[id][rotation] - нижние клетки столбцов фигуры
+SHAPES, KICKS, BOTTOMS = build_tables()
+
+
+# Правила над масками строк - общие для движка и перебора мест в tetris_bot
+def spawn(figure_id):
+    """Pivot cell (x, y) of a figure in its start position at the top of the field"""
+    x, y = FIGURES_POS[figure_id][0]
+    return x + 5, y + 1
+
+
+def fits(rows, figure_id, rot, x, y):
+    """Figure with its pivot at (x, y) stays inside a field of row masks and its free cells"""
+    for dx, dy in SHAPES[figure_id][rot]:
+        cx, cy = x + dx, y + dy
+        if not (0 <= cx <= 9 and 0 <= cy <= 19) or rows[cy] >> cx & 1:
+            return False
+    return True
+
+
+def kick(rows, figure_id, rot, x, y):
+    """Pivot (x, y) of the figure turned to rot by the first kick offset that fits, None if none does"""
+    for kx, ky in KICKS[figure_id][rot]:
+        if fits(rows, figure_id, rot, x + kx, y + ky):
+            return x + kx, y + ky
+    return None
+
+
+def landing_y(rows, heights, figure_id, rot, x, y):
+    """Pivot row where a figure at (x, y) comes to rest if dropped straight down"""
+    land = min(19 - heights[x + dx] - dy for dx, dy in BOTTOMS[figure_id][rot])
+    if land < y:
+        # фигура ниже вершины своего столбца (задвинута под навес) - спуск по клеткам
+        land = y
+        while fits(rows, figure_id, rot, x, land + 1):
+            land += 1
+    return land
+
+
+# Входы одного шага (битовая маска)
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_DOWN = 4
+INPUT_ROTATE = 8
+INPUT_DROP = 16  # мгновенный сброс с фиксацией
+
+# События одного шага (битовая маска)
+EVENT_MOVE = 1
+EVENT_ROTATE = 2
+EVENT_PLACE = 4
+EVENT_LINE = 8
+EVENT_LEVEL = 16
+EVENT_GAME_OVER = 32
+
+
+# Неизменяемый снимок всего состояния игры, включая генератор фигур; кортежи поля общие у снимков
+# до следующего изменения поля, строки цветов - у всех снимков, пока строку не заменит фиксация
+Snapshot = namedtuple('Snapshot', 'rows field heights piece next_id color next_color anim_count anim_speed anim_limit '
+                                  'anim_lines count_anim_lines full_rows last_lock score level best game_over seed rng')
+
+
+class Piece:
+    """Figure on the field: id, rotation and pivot cell, changed in place"""
+
+    __slots__ = ('figure_id', 'rot', 'x', 'y')
+    created = 0  # счетчик созданных фигур для бенчмарков
+
+    def __init__(self, figure_id=0):
+        Piece.created += 1
+        self.reset(figure_id)
+
+    def reset(self, figure_id):
+        """Put the figure in its start position at the top of the field"""
+        self.figure_id, self.rot = figure_id, 0
+        self.x, self.y = spawn(figure_id)
+
+    def cells(self):
+        """Field cells of the figure as (x, y) tuples"""
+        return [(self.x + dx, self.y + dy) for dx, dy in SHAPES[self.figure_id][self.rot]]
+
+    @staticmethod
+    def find(cells):
+        """Return (id, rotation) of a figure given as a list of cells"""
+        x0, y0 = cells[0][0], cells[0][1]
+        offsets = tuple((cell[0] - x0, cell[1] - y0) for cell in cells)
+        for figure_id, orients in enumerate(SHAPES):
+            if offsets in orients:
+                return figure_id, orients.index(offsets)
+        raise ValueError('unknown figure %r' % (offsets,))
+
+
+class TetrisEngine:
+    """Game rules without display, one step() per fixed TICK_MS of game time"""
+
+    def __init__(self, seed=None):
+        """Create an engine, the first game is played with the given seed"""
+        self.best = 0
+        self.new_game(seed)
+
+    def random_figure(self):
+        self.draws += 1
+        return self.rng.randrange(len(SHAPES))
+
+    def set_figures(self, figure, next_figure):
+        """Restore the current and next figures from lists of cells"""
+        self.piece.figure_id, self.piece.rot = Piece.find(figure)
+        self.piece.x, self.piece.y = figure[0][0], figure[0][1]
+        self.next_piece.reset(Piece.find(next_figure)[0])
+
+    def random_color(self):
+        self.draws += 1
+        return self.rng.randint(128, 255), self.rng.randint(128, 255), self.rng.randint(128, 255)
+
+    def seek_rng(self, seed, draws):
+        """Put the figure generator where a game of the seed had it after the given number of draws"""
+        if draws < 4 or draws % 2:
+            raise ValueError('%d draws do not come from a game' % draws)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.draws = 0
+        self.rng_state = None
+        # те же выборки в том же порядке: две фигуры и два цвета новой игры, затем фигура и цвет на фиксацию
+        self.random_figure(), self.random_figure(), self.random_color(), self.random_color()
+        while self.draws < draws:
+            self.random_figure(), self.random_color()
+
+    def new_game(self, seed=None):
+        """Start a game whose figures and colours depend only on the seed"""
+        self.seed = seed if seed is not None else random.randrange(1 << 32)
+        self.rng = random.Random(self.seed)
+        self.draws = 0  # выборок из rng: его состояние меняется только вместе с ними
+        self.rng_state = None  # (draws, упакованный rng.getstate()) последнего снимка - общий до следующей выборки
+
+        # две фигуры на всю игру: при фиксации текущая и следующая меняются местами
+        self.piece, self.next_piece = Piece(self.random_figure()), Piece(self.random_figure())
+        self.color, self.next_color = self.random_color(), self.random_color()
+
+        # Матрица игрового поля: цвета клеток и битовые маски занятости строк
+        # строки цветов - кортежи: фиксация заменяет строку целиком, снимки делят неизменные строки
+        self.field = [EMPTY_ROW] * 20
+        self.rows = [0] * 20
+        self.heights = [0] * 10  # высота каждого столбца: от дна до верхней занятой клетки
+        self.board = None  # (rows, field, heights) кортежами для снимков - до следующего изменения поля
+
+        # Параметры анимации движения
+        self.anim_count, self.anim_speed, self.anim_limit = 0, 1, GRAVITY_TICKS
+
+        # анимация исчезновения линий
+        self.anim_lines = False
+        self.count_anim_lines = 0
+        self.full_rows = []
+
+        # последняя фиксация: id, поворот, x, y фигуры и число заполненных ею строк
+        self.last_lock = None
+
+        self.score = 0
+        self.level = 1
+        self.game_over = False
+
+    def snapshot(self):
+        """Return the whole state as an immutable Snapshot, cheap enough to take every step"""
+        p = self.piece
+        board = self.board
+        if board is None:
+            board = self.board = (tuple(self.rows), tuple(self.field), tuple(self.heights))
+        return Snapshot(*board, (p.figure_id, p.rot, p.x, p.y), self.next_piece.figure_id, self.color, self.next_color,
+                        self.anim_count, self.anim_speed, self.anim_limit, self.anim_lines, self.count_anim_lines,
+                        tuple(self.full_rows), self.last_lock, self.score, self.level, self.best, self.game_over,
+                        self.seed, self.rng_snapshot())
+
+    def rng_snapshot(self):
+        if self.rng_state is None or self.rng_state[0] != self.draws:
+            # 625 слов состояния - 2.5 КБ байтов вместо кортежа из 625 объектов int
+            version, words, gauss = self.rng.getstate()
+            self.rng_state = (self.draws, (version, array('I', words).tobytes(), gauss))
+        return self.rng_state
+
+    def restore(self, snapshot):
+        """Return to a state taken by snapshot(); the snapshot stays valid for further restores"""
+        s = snapshot
+        self.rows, self.field, self.heights = list(s.rows), list(s.field), list(s.heights)
+        self.board = s.rows, s.field, s.heights
+        p = self.piece
+        p.figure_id, p.rot, p.x, p.y = s.piece
+        self.next_piece.reset(s.next_id)
+        self.color, self.next_color = s.color, s.next_color
+        self.anim_count, self.anim_speed, self.anim_limit = s.anim_count, s.anim_speed, s.anim_limit
+        self.anim_lines, self.count_anim_lines, self.full_rows = s.anim_lines, s.count_anim_lines, list(s.full_rows)
+        self.last_lock, self.score, self.level, self.best, self.game_over = (s.last_lock, s.score, s.level, s.best,
+                                                                             s.game_over)
+        self.seed = s.seed
+        # генератор не трогали со снимка - его состояние уже совпадает
+        if s.rng is not self.rng_state or self.draws != s.rng[0]:
+            version, words, gauss = s.rng[1]
+            self.rng.setstate((version, tuple(array('I', words)), gauss))
+            self.draws, self.rng_state = s.rng[0], s.rng
+
+    def set_field(self, field):
+        """Replace the colour matrix and rebuild the row masks and column heights from it"""
+        self.field = [tuple(row) for row in field]
+        self.rows = [sum(1 << x for x in range(10) if row[x]) for row in field]
+        self.board = None
+        self.heights = [self.column_height(x) for x in range(10)]
+        full_rows = [y for y, mask in enumerate(self.rows) if mask == FULL_ROW]
+        if full_rows and not self.game_over:
+            self.mark_lines(full_rows)
+
+    def mark_lines(self, full_rows):
+        """Flash the full rows and start the line animation"""
+        self.full_rows = full_rows
+        for y in full_rows:
+            self.field[y] = (FLASH,) * 10
+        self.board = None
+        self.anim_lines = True
+
+    def column_height(self, x):
+        """Scan the row masks for the top occupied cell of a column"""
+        for y, mask in enumerate(self.rows):
+            if mask >> x & 1:
+                return 20 - y
+        return 0
+
+    def landing_y(self):
+        """Pivot row where the figure comes to rest if dropped straight down"""
+        p = self.piece
+        return landing_y(self.rows, self.heights, p.figure_id, p.rot, p.x, p.y)
+
+    def fits(self, figure_id, rot, x, y):
+        """Figure with its pivot at (x, y) stays inside the field and free cells"""
+        return fits(self.rows, figure_id, rot, x, y)
+
+    def move_x(self, dx):
+        """Shift the figure sideways, roll the move back if it does not fit"""
+        p = self.piece
+        p.x += dx
+        if fits(self.rows, p.figure_id, p.rot, p.x, p.y):
+            return True
+        p.x -= dx
+        return False
+
+    def rotate(self):
+        """Rotate the figure by one table lookup, trying the kick offsets in order"""
+        p = self.piece
+        shapes = SHAPES[p.figure_id]
+        if len(shapes) == 1:
+            return False  # квадрат не вращать !!!
+
+        rot = (p.rot + 1) % len(shapes)
+        pos = kick(self.rows, p.figure_id, rot, p.x, p.y)
+        if pos is None:
+            return False
+        p.rot, (p.x, p.y) = rot, pos
+        return True
+
+    def move_y(self):
+        """Move the figure one row down, lock it on contact, return EVENT_* flags"""
+        p = self.piece
+        if fits(self.rows, p.figure_id, p.rot, p.x, p.y + 1):
+            p.y += 1
+            return 0
+
+        return self.lock(self.random_figure(), self.random_color())
+
+    def hard_drop(self):
+        """Put the figure on its landing row and lock it at once, return EVENT_* flags"""
+        self.piece.y = self.landing_y()
+        return self.lock(self.random_figure(), self.random_color())
+
+    def lock(self, next_id, next_color):
+        """Fix the figure on the field and bring in the next one, return EVENT_* flags"""
+        p = self.piece
+        shape = SHAPES[p.figure_id][p.rot]
+        heights = self.heights
+        self.board = None
+        for dx, dy in shape:
+            self.rows[p.y + dy] |= 1 << p.x + dx
+            row = self.field[p.y + dy]
+            self.field[p.y + dy] = row[:p.x + dx] + (self.color,) + row[p.x + dx + 1:]
+            if heights[p.x + dx] < 20 - p.y - dy:
+                heights[p.x + dx] = 20 - p.y - dy
+
+        # check anim_lines: заполниться могли только строки зафиксированной фигуры
+        full_rows = sorted({p.y + dy for dx, dy in shape if self.rows[p.y + dy] == FULL_ROW})
+        self.last_lock = (p.figure_id, p.rot, p.x, p.y, len(full_rows))
+
+        self.piece, self.next_piece = self.next_piece, p
+        self.next_piece.reset(next_id)
+        self.color, self.next_color = self.next_color, next_color
+
+        # check game_over
+        p = self.piece
+        if not fits(self.rows, p.figure_id, p.rot, p.x, p.y):
+            self.game_over = True
+            return EVENT_PLACE | EVENT_GAME_OVER
+        if full_rows:
+            self.mark_lines(full_rows)
+        return EVENT_PLACE
+
+    def clear_lines(self):
+        """Remove the flashing rows, return the number of cleared lines"""
+        self.count_anim_lines = 0
+        self.anim_lines = False
+
+        # check lines: заполненные строки убираются, сверху добавляются пустые
+        lines = len(self.full_rows)
+        for y in reversed(self.full_rows):
+            del self.rows[y]
+            del self.field[y]
+        self.rows[:0] = [0] * lines
+        self.field[:0] = [EMPTY_ROW] * lines
+        self.board = None
+
+        # столбцы выше убранных строк просто опускаются, верх остальных был в убранной строке
+        top = 20 - self.full_rows[0]
+        for x in range(10):
+            if self.heights[x] > top:
+                self.heights[x] -= lines
+            else:
+                self.heights[x] = self.column_height(x)
+        self.full_rows = []
+        return lines
+
+    def replay_lock(self, figure_id, rot, x, y, next_id, next_color, lines):
+        """Lock the figure where a journal recorded it, clearing lines at once, return EVENT_* flags"""
+        events = self.add_score(self.clear_lines()) if self.anim_lines else 0
+        p = self.piece
+        if self.game_over or p.figure_id != figure_id or not self.fits(figure_id, rot, x, y):
+            raise ValueError('journal does not match the game')
+
+        # следующая фигура - из генератора, как при игре; журнал только подтверждает ее
+        if (self.random_figure(), self.random_color()) != (next_id, next_color):
+            raise ValueError('journal does not match the game')
+        p.rot, p.x, p.y = rot, x, y
+        events |= self.lock(next_id, next_color)
+        if self.last_lock[4] != lines:
+            raise ValueError('journal does not match the game')
+        if self.anim_lines:
+            events |= self.add_score(self.clear_lines())
+        return events
+
+    def add_score(self, lines):
+        """Count cleared lines and the level, return EVENT_* flags"""
+        if lines == 0:
+            return 0
+
+        old_score = self.score
+        self.score += lines
+        if self.score > self.best: self.best = self.score
+
+        # каждые 10 линий - новый уровень
+        if self.score // 10 > old_score // 10 and old_score < 1000:
+            self.anim_speed += 0.5
+            self.level += 1
+            return EVENT_LINE | EVENT_LEVEL
+        return EVENT_LINE
+
+    def step(self, inputs=0):
+        """Advance the game by one tick with INPUT_* flags, return EVENT_* flags"""
+        events = 0
+
+        if not self.anim_lines and not self.game_over:
+            # move x
+            dx = 1 if inputs & INPUT_RIGHT else -1 if inputs & INPUT_LEFT else 0
+            if dx != 0:
+                events |= EVENT_MOVE
+                self.move_x(dx)
+
+            # rotate
+            if inputs & INPUT_ROTATE:
+                events |= EVENT_ROTATE
+                self.rotate()
+
+            # move y: сброс сразу до места падения
+            if inputs & INPUT_DROP:
+                self.anim_count = 0
+                events |= self.hard_drop()
+            else:
+                self.anim_count += self.anim_speed
+                if self.anim_count >= self.anim_limit or inputs & INPUT_DOWN:
+                    self.anim_count = 0
+                    events |= self.move_y()
+
+        if self.anim_lines:
+            self.count_anim_lines += 1
+            if self.count_anim_lines == LINES_TICKS:
+                events |= self.add_score(self.clear_lines())
+
+        return events
+
+
+if __name__ == '__main__':
+    # headless soak: случайные входы, печать тиков в секунду
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    engine = TetrisEngine(0)
+    rng = random.Random(1)
+    inputs = [rng.choice((0, 0, 0, INPUT_LEFT, INPUT_RIGHT, INPUT_DOWN, INPUT_ROTATE, INPUT_DROP)) for i in range(1024)]
+    games = 1
+    start = time.perf_counter()
+    for tick in range(ticks):
+        engine.step(inputs[tick & 1023])
+        if engine.game_over:
+            engine.new_game(games)
+            games += 1
+    elapsed = time.perf_counter() - start
+    print('%d ticks, %d games, %.0f ticks/s' % (ticks, games, ticks / elapsed))
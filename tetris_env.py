@@ -0,0 +1,100 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+"""Gym-style environment over the tetris rules: reset(seed) / step(action) with NumPy observations"""
+
+import random
+import sys
+import time
+
+import numpy
+
+from tetris_engine import TetrisEngine, SHAPES, INPUT_LEFT, INPUT_RIGHT, INPUT_DOWN, INPUT_ROTATE, INPUT_DROP
+
+
+# действия - номера, как в дискретном пространстве действий gym
+ACTIONS = (0, INPUT_LEFT, INPUT_RIGHT, INPUT_DOWN, INPUT_ROTATE, INPUT_DROP)
+ACTION_NAMES = ('noop', 'left', 'right', 'down', 'rotate', 'drop')
+COLUMNS = numpy.arange(10, dtype=numpy.uint16)
+
+
+class TetrisEnv:
+    """One game, one engine step per action, no display or clock"""
+
+    def __init__(self, ticks_per_step=1, tile=16):
+        self.ticks_per_step = ticks_per_step  # шагов движка на действие; входы - только в первом
+        self.tile = tile  # размер клетки в render()
+        self.engine = TetrisEngine()
+        self.surface = None
+
+    @property
+    def action_count(self):
+        return len(ACTIONS)
+
+    def reset(self, seed=None):
+        """Start a new game, return the first observation"""
+        self.engine.new_game(seed)
+        return self.observation()
+
+    def step(self, action):
+        """Apply an ACTIONS index, return (observation, lines cleared, game over, info)"""
+        engine = self.engine
+        score = engine.score
+        events = engine.step(ACTIONS[action])
+        for i in range(self.ticks_per_step - 1):
+            if engine.game_over:
+                break
+            events |= engine.step()
+        info = {'score': engine.score, 'level': engine.level, 'events': events}
+        return self.observation(), engine.score - score, engine.game_over, info
+
+    def observation(self):
+        """Field as uint8 (20, 10): 1 - fixed cell, 2 - falling figure; ids of the figure and the next one"""
+        engine = self.engine
+        field = (numpy.array(engine.rows, dtype=numpy.uint16)[:, None] >> COLUMNS & 1).astype(numpy.uint8)
+        if not engine.game_over:
+            p = engine.piece
+            for dx, dy in SHAPES[p.figure_id][p.rot]:
+                field[p.y + dy, p.x + dx] = 2
+        return {'field': field, 'piece': engine.piece.figure_id, 'next': engine.next_piece.figure_id}
+
+    def render(self):
+        """RGB frame of the board as uint8 (20 * tile, 10 * tile, 3), drawn like the game board"""
+        import pygame
+        from pygame_tetris import BLACK, GREY
+
+        tile, engine = self.tile, self.engine
+        if self.surface is None:
+            self.surface = pygame.Surface((tile * 10, tile * 20))
+            self.cell = pygame.Rect(0, 0, tile - 2, tile - 2)
+        surface, cell = self.surface, self.cell
+        surface.fill(BLACK)
+        for x in range(10):
+            for y in range(20):
+                pygame.draw.rect(surface, GREY, (x * tile, y * tile, tile, tile), 1)
+        cells = [(x, y, col) for y, row in enumerate(engine.field) for x, col in enumerate(row) if col]
+        if not engine.game_over:
+            cells += [(x, y, engine.color) for x, y in engine.piece.cells()]
+        for x, y, col in cells:
+            cell.x, cell.y = x * tile, y * tile
+            pygame.draw.rect(surface, col, cell)
+        return pygame.surfarray.array3d(surface).swapaxes(0, 1)
+
+
+if __name__ == '__main__':
+    # случайная политика: python tetris_env.py [steps]
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    env = TetrisEnv()
+    rng = random.Random(0)
+    obs = env.reset(0)
+    games, lines = 1, 0
+    start = time.perf_counter()
+    for i in range(steps):
+        obs, reward, done, info = env.step(rng.randrange(env.action_count))
+        lines += reward
+        if done:
+            obs = env.reset(games)
+            games += 1
+    elapsed = time.perf_counter() - start
+    print('%d steps, %d games, %d lines, %.0f steps/s' % (steps, games, lines, steps / elapsed))
+    print('frame', env.render().shape)
@@ -0,0 +1,134 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+"""Seeded input replays: compact recording and headless playback with verification"""
+
+import struct
+import sys
+import time
+import zlib
+
+import tetris_save
+from tetris_engine import TetrisEngine, TICK_MS
+
+
+# Заголовок: сигнатура, версия, seed, число шагов, итоговый счет, маски 20 строк итогового поля,
+# длина начального состояния, длина и контрольная сумма состояния и событий;
+# состояние - сохранение tetris_save продолженной игры, у новой игры пустое;
+# события - varint шагов от прошлого события и байт INPUT_*
+MAGIC = b'TTRR'
+VERSION = 3  # 2: INPUT_DROP - мгновенный сброс, 3: начальное состояние, версия 2 читается без него
+HEADER = struct.Struct('<4sBQII20HIII')
+HEADER_V2 = struct.Struct('<4sBQII20HII')
+
+
+class ReplayError(Exception):
+    """Replay data is damaged or of an unknown version"""
+
+
+class Recorder:
+    """Records the inputs of every engine step that had any, from a new game or a packed save"""
+
+    def __init__(self, seed, start=b''):
+        self.seed = seed
+        self.start = start
+        self.tick = 0
+        self.last = 0
+        self.events = bytearray()
+
+    def record(self, inputs):
+        """Note the inputs of the next engine step"""
+        if inputs:
+            delta = self.tick - self.last
+            while delta >= 0x80:
+                self.events.append(delta & 0x7f | 0x80)
+                delta >>= 7
+            self.events.append(delta)
+            self.events.append(inputs)
+            self.last = self.tick
+        self.tick += 1
+
+    def pack(self, engine):
+        """Pack the recording together with the final score and field of the engine"""
+        body = self.start + self.events
+        return HEADER.pack(MAGIC, VERSION, self.seed, self.tick, engine.score, *engine.rows, len(self.start),
+                           len(body), zlib.crc32(body)) + body
+
+
+def unpack(data):
+    """Return (seed, ticks, score, rows, start, [(tick, inputs), ...]) of a packed replay"""
+    if len(data) < HEADER_V2.size:
+        raise ReplayError('replay is too short')
+    magic, version = data[:4], data[4]
+    if magic != MAGIC:
+        raise ReplayError('not a tetris replay')
+    if version == VERSION:
+        if len(data) < HEADER.size:
+            raise ReplayError('replay is too short')
+        values = HEADER.unpack_from(data)
+        start_length, length, crc = values[25:]
+        body = data[HEADER.size:]
+    elif version == 2:
+        values = HEADER_V2.unpack_from(data)
+        start_length, (length, crc) = 0, values[25:]
+        body = data[HEADER_V2.size:]
+    else:
+        raise ReplayError('unknown replay version %d' % version)
+    seed, ticks, score = values[2:5]
+    rows = list(values[5:25])
+    if len(body) != length or start_length > length or zlib.crc32(body) != crc:
+        raise ReplayError('replay is damaged')
+    start, events = body[:start_length], body[start_length:]
+
+    result, tick, i = [], 0, 0
+    while i < len(events):
+        delta, shift = 0, 0
+        while events[i] & 0x80:
+            delta |= (events[i] & 0x7f) << shift
+            shift += 7
+            i += 1
+        delta |= events[i] << shift
+        tick += delta
+        result.append((tick, events[i + 1]))
+        i += 2
+    return seed, ticks, score, rows, start, result
+
+
+def play(data):
+    """Re-run a replay headless, return (engine, verified)"""
+    seed, ticks, score, rows, start, events = unpack(data)
+    engine = TetrisEngine(seed)
+    if start:
+        # продолженная игра: состояние и генератор фигур - из сохранения, с которого шла запись
+        try:
+            tetris_save.unpack(start, engine)
+        except tetris_save.SaveError as e:
+            raise ReplayError('damaged start state: %s' % e) from e
+    tick = 0
+    for event_tick, inputs in events:
+        while tick < event_tick:
+            engine.step()
+            tick += 1
+        engine.step(inputs)
+        tick += 1
+    while tick < ticks:
+        engine.step()
+        tick += 1
+    return engine, engine.score == score and engine.rows == rows
+
+
+if __name__ == '__main__':
+    # headless playback: python tetris_replay.py file.rpl ...
+    failed = 0
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as f:
+            data = f.read()
+        start = time.perf_counter()
+        engine, verified = play(data)
+        elapsed = time.perf_counter() - start
+        ticks = unpack(data)[1]
+        print('%s: seed %d, %d ticks (%.1fx real time), score %d, %s'
+              % (path, engine.seed, ticks, ticks * TICK_MS / 1000 / max(elapsed, 1e-9), engine.score,
+                 'ok' if verified else 'MISMATCH'))
+        failed += not verified
+    sys.exit(1 if failed else 0)
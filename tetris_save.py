@@ -0,0 +1,241 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+"""Compact versioned save format, lock journal and atomic background writes"""
+
+from functools import partial
+import os
+import pickle
+import queue
+import struct
+import sys
+import threading
+import zlib
+
+from tetris_engine import SHAPES
+
+
+# Заголовок: сигнатура, версия, длина и контрольная сумма данных
+MAGIC = b'TTRS'
+VERSION = 2  # 2: seed и число выборок генератора фигур, версия 1 читается без них
+HEADER = struct.Struct('<4sBHI')
+
+# Состояние: best, score, level, anim_speed, флаги, фигура (id, поворот, x, y), id следующей,
+# цвет фигуры, цвет следующей, маски 20 строк, seed, число выборок генератора;
+# за ним - по 3 байта цвета на каждую занятую клетку
+STATE = struct.Struct('<IIHfB4bB3B3B20HQI')
+STATE_V1 = struct.Struct('<IIHfB4bB3B3B20H')
+
+# Журнал фиксаций после снимка: заголовок с CRC32 снимка, затем записи по 13 байт -
+# id, поворот, x, y фигуры, id следующей, цвет следующей, число заполненных строк и CRC32 этих 9 байт
+JOURNAL_MAGIC = b'TTJ2'  # TTJ2: записи с контрольной суммой, журналы TTRJ не читаются
+JOURNAL_HEADER = struct.Struct('<4sI')
+LOCK = struct.Struct('<BBbbB3BB')
+LOCK_CRC = struct.Struct('<I')
+LOCK_SIZE = LOCK.size + LOCK_CRC.size
+
+FLAG_GAME_OVER = 1
+FLAG_SOUND = 2
+FLAG_MUSIC = 4
+
+
+class SaveError(Exception):
+    """Save data is missing, damaged or of an unknown version"""
+
+
+def pack(engine, sound, music):
+    """Pack the game state and settings into bytes with a header"""
+    p = engine.piece
+    flags = (FLAG_GAME_OVER if engine.game_over else 0) | (FLAG_SOUND if sound else 0) | (FLAG_MUSIC if music else 0)
+    payload = bytearray(STATE.pack(engine.best, engine.score, engine.level, engine.anim_speed, flags,
+                                   p.figure_id, p.rot, p.x, p.y, engine.next_piece.figure_id,
+                                   *engine.color[:3], *engine.next_color[:3], *engine.rows, engine.seed,
+                                   engine.draws))
+    for row in engine.field:
+        for col in row:
+            if col:
+                payload += bytes((col[0], col[1], col[2]))
+    return HEADER.pack(MAGIC, VERSION, len(payload), zlib.crc32(payload)) + payload
+
+
+def unpack(data, engine):
+    """Restore the game state from bytes made by pack(), return (sound, music)"""
+    if len(data) < HEADER.size:
+        raise SaveError('save is too short')
+    magic, version, length, crc = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SaveError('not a tetris save')
+    if version not in (1, VERSION):
+        raise SaveError('unknown save version %d' % version)
+    payload = data[HEADER.size:]
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        raise SaveError('save is damaged')
+
+    state = STATE if version == VERSION else STATE_V1
+    if length < state.size:
+        raise SaveError('save is damaged')
+    values = state.unpack_from(payload)
+    best, score, level, anim_speed, flags, figure_id, rot, x, y, next_id = values[:10]
+    color, next_color, rows = values[10:13], values[13:16], values[16:36]
+    if not (0 <= figure_id < len(SHAPES) and 0 <= rot < len(SHAPES[figure_id]) and 0 <= next_id < len(SHAPES)):
+        raise SaveError('unknown figure in save')
+    if length != state.size + 3 * sum(bin(mask).count('1') for mask in rows):
+        raise SaveError('save is damaged')
+
+    # генератор фигур с того места, где его оставила игра; у версии 1 - новый seed движка
+    if version == VERSION:
+        seed, draws = values[36:]
+        try:
+            engine.seek_rng(seed, draws)
+        except ValueError as e:
+            raise SaveError('save is damaged: %s' % e) from e
+
+    # цвета занятых клеток по порядку строк
+    field = [[0 for i in range(10)] for j in range(20)]
+    offset = state.size
+    for row, mask in zip(field, rows):
+        for i in range(10):
+            if mask >> i & 1:
+                row[i] = tuple(payload[offset:offset + 3])
+                offset += 3
+
+    engine.best, engine.score, engine.level, engine.anim_speed = best, score, level, anim_speed
+    engine.game_over = bool(flags & FLAG_GAME_OVER)
+    engine.color, engine.next_color = color, next_color
+    engine.piece.figure_id, engine.piece.rot, engine.piece.x, engine.piece.y = figure_id, rot, x, y
+    engine.next_piece.reset(next_id)
+    engine.set_field(field)
+    return bool(flags & FLAG_SOUND), bool(flags & FLAG_MUSIC)
+
+
+def unpack_legacy(data, engine):
+    """Restore the game state from a pickled dict of version 1.0, return (sound, music)"""
+    try:
+        state = pickle.loads(data)
+        engine.best = state['best']
+        engine.score = state['score']
+        engine.level = state['level']
+        engine.game_over = state['game_over']
+        engine.anim_speed = state['anim_speed']
+        engine.color = state['color']
+        engine.next_color = state['next_color']
+        # старые сохранения хранят фигуры списками pygame.Rect
+        engine.set_figures(state['figure'], state['next_figure'])
+        engine.set_field(state['field'])
+        return state['sound'], state['music']
+    except Exception as e:  # pickle может выбросить почти что угодно
+        raise SaveError('damaged legacy save: %r' % e) from e
+
+
+def pack_lock(engine):
+    """Pack the last figure lock of the engine into a journal record"""
+    figure_id, rot, x, y, lines = engine.last_lock
+    record = LOCK.pack(figure_id, rot, x, y, engine.next_piece.figure_id, *engine.next_color[:3], lines)
+    return record + LOCK_CRC.pack(zlib.crc32(record))
+
+
+def replay_journal(path, engine, snapshot):
+    """Replay the journal records made after the given snapshot bytes, return their number"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return 0
+    if len(data) < JOURNAL_HEADER.size or JOURNAL_HEADER.unpack_from(data) != (JOURNAL_MAGIC, zlib.crc32(snapshot)):
+        return 0  # журнал от другого снимка
+
+    count = 0
+    # недописанная последняя запись отбрасывается, поврежденная - обрывает журнал
+    for offset in range(JOURNAL_HEADER.size, len(data) - LOCK_SIZE + 1, LOCK_SIZE):
+        if LOCK_CRC.unpack_from(data, offset + LOCK.size)[0] != zlib.crc32(data[offset:offset + LOCK.size]):
+            break
+        figure_id, rot, x, y, next_id, r, g, b, lines = LOCK.unpack_from(data, offset)
+        if not (0 <= figure_id < len(SHAPES) and 0 <= rot < len(SHAPES[figure_id]) and 0 <= next_id < len(SHAPES)):
+            break
+        try:
+            engine.replay_lock(figure_id, rot, x, y, next_id, (r, g, b), lines)
+        except ValueError:
+            break
+        count += 1
+    return count
+
+
+def load(path, engine, journal_path=None):
+    """Read a save of any known format into the engine, replay its journal, return (sound, music)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] == MAGIC:
+        settings = unpack(data, engine)
+    else:
+        settings = unpack_legacy(data, engine)
+    if journal_path:
+        replay_journal(journal_path, engine, data)
+    return settings
+
+
+def write_atomic(path, data):
+    """Write to a temporary file and rename it over the save, so a crash never leaves half a file"""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class SaveWriter:
+    """Background thread writing snapshots and journal records in the order they were queued"""
+
+    def __init__(self, path, journal_path=None):
+        self.path = path
+        self.journal_path = journal_path
+        self.journal = None
+        self.error = None  # последняя ошибка записи
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='save-writer', daemon=True)
+        self.thread.start()
+
+    def save(self, data):
+        """Queue a packed snapshot, the journal starts over after it"""
+        self.queue.put((self.write_snapshot, data))
+
+    def append(self, record):
+        """Queue a journal record"""
+        self.queue.put((self.write_record, record))
+
+    def write(self, path, data):
+        """Queue an atomic write of any other file"""
+        self.queue.put((partial(write_atomic, path), data))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            func, data = item
+            try:
+                func(data)
+            except OSError as e:
+                # игра идет дальше, но без записи: сообщить, как и об ошибке загрузки
+                self.error = e
+                print('save not written: %s' % e, file=sys.stderr)
+        if self.journal:
+            self.journal.close()
+
+    def write_snapshot(self, data):
+        write_atomic(self.path, data)
+        if self.journal_path:
+            # сжатие: записи до снимка больше не нужны
+            if self.journal:
+                self.journal.close()
+            self.journal = open(self.journal_path, 'wb', buffering=0)
+            self.journal.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, zlib.crc32(data)))
+
+    def write_record(self, record):
+        if self.journal:
+            self.journal.write(record)
+
+    def close(self):
+        """Write everything queued and stop the thread"""
+        self.queue.put(None)
+        self.thread.join()
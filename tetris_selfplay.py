@@ -0,0 +1,93 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+"""Self-play runner: headless games on a process pool, one seed per game, results as JSONL"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+import traceback
+
+import tetris_bot
+from tetris_engine import (TetrisEngine, INPUT_LEFT, INPUT_RIGHT, INPUT_DOWN, INPUT_ROTATE, INPUT_DROP,
+                           EVENT_PLACE)
+
+
+# случайные входы, как в прогоне tetris_engine.py
+RANDOM_INPUTS = (0, 0, 0, INPUT_LEFT, INPUT_RIGHT, INPUT_DOWN, INPUT_ROTATE, INPUT_DROP)
+
+
+def play_game(job):
+    """Play one game to the end or to max_ticks, return its result; exceptions are returned with the seed"""
+    seed, player, weights, max_ticks = job
+    result = {'seed': seed, 'player': player, 'score': 0, 'level': 1, 'pieces': 0, 'ticks': 0}
+    start = time.perf_counter()
+    engine = None
+    pieces = ticks = 0
+    try:
+        engine = TetrisEngine(seed)
+        if player == 'bot':
+            bot = tetris_bot.Bot(engine, dict(tetris_bot.WEIGHTS, **weights))
+            next_inputs = bot.inputs
+        else:
+            rng = random.Random(seed)
+            next_inputs = lambda: rng.choice(RANDOM_INPUTS)
+
+        while not engine.game_over and ticks < max_ticks:
+            if engine.step(next_inputs()) & EVENT_PLACE:
+                pieces += 1
+            ticks += 1
+    except Exception:
+        result['error'] = traceback.format_exc()
+    # счетчики и после исключения: с ними видно, на каком шаге оно случилось
+    result.update(pieces=pieces, ticks=ticks)
+    if engine is not None:
+        result.update(score=engine.score, level=engine.level, finished=engine.game_over)
+    result['wall'] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--games', type=int, default=100, help='number of games')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game, the others follow it')
+    parser.add_argument('--player', choices=('bot', 'random'), default='bot')
+    parser.add_argument('--weights', type=json.loads, default={}, help='bot weights as JSON, e.g. \'{"holes": -0.5}\'')
+    parser.add_argument('--max-ticks', type=int, default=100000, help='stop a game after this many ticks')
+    parser.add_argument('--processes', type=int, default=None, help='pool size, all CPUs by default')
+    parser.add_argument('--out', default='selfplay.jsonl', help='JSONL file with one line per game')
+    args = parser.parse_args()
+    unknown = set(args.weights) - set(tetris_bot.WEIGHTS)
+    if unknown:
+        parser.error('unknown weights: %s (known: %s)' % (', '.join(sorted(unknown)), ', '.join(tetris_bot.WEIGHTS)))
+
+    jobs = [(seed, args.player, args.weights, args.max_ticks) for seed in range(args.seed, args.seed + args.games)]
+    scores, errors, ticks = [], 0, 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool, open(args.out, 'w') as out:
+        # результаты пишутся по мере готовности: прерванный прогон оставляет все доигранные игры
+        for result in pool.imap_unordered(play_game, jobs, chunksize=max(1, args.games // 256)):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            ticks += result['ticks']
+            if 'error' in result:
+                errors += 1
+                print('seed %d failed:\n%s' % (result['seed'], result['error']), file=sys.stderr)
+            else:
+                scores.append(result['score'])
+    elapsed = time.perf_counter() - start
+
+    scores.sort()
+    print('%d games in %.1f s: %.1f games/s, %.0f ticks/s, %d errors'
+          % (args.games, elapsed, args.games / elapsed, ticks / elapsed, errors))
+    if scores:
+        print('lines: min %d, median %d, mean %.1f, max %d'
+              % (scores[0], scores[len(scores) // 2], sum(scores) / len(scores), scores[-1]))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())